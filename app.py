@@ -1,32 +1,158 @@
 import asyncio
 import os
-import requests
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 from dotenv import find_dotenv, load_dotenv
 load_dotenv(find_dotenv())
 
-from handlers import user_cmd
+from handlers import glpi_webhook, user_cmd
+from middlewares.concurrency import ConcurrencyLimitMiddleware
+from utils import categorizer, category_catalog, similar_tickets
+from utils.fsm_storage import SQLiteStorage
 
-ALLOWED_UPDATES = ['message, edited_message']
+ALLOWED_UPDATES = ['message', 'edited_message', 'callback_query']
+
+# Способ получения апдейтов: polling (long polling) или webhook
+BOT_MODE = os.getenv('bot_mode', 'polling')
+# Опрос GLPI нужен в одном процессе: при нескольких воркерах за балансировщиком
+# он включается только на одном из них
+RUN_POLLER = os.getenv('run_poller', '1') == '1'
+
+# Публичный адрес бота (https://bot.example.com) и путь вебхука на нем
+WEBHOOK_URL = os.getenv('webhook_url')
+WEBHOOK_PATH = os.getenv('webhook_path', '/telegram/webhook')
+# Telegram передает его в заголовке X-Telegram-Bot-Api-Secret-Token, запросы без него отклоняются
+WEBHOOK_SECRET = os.getenv('webhook_secret')
+WEBHOOK_HOST = os.getenv('webhook_host', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('webhook_port', 8080))
+# Сколько апдейтов процесс обрабатывает одновременно
+WEBHOOK_CONCURRENCY = int(os.getenv('webhook_concurrency', 20))
+# Регистрировать вебхук в Telegram при старте (достаточно одного воркера)
+WEBHOOK_REGISTER = os.getenv('webhook_register', '1') == '1'
+
+# Состояния диалогов (авторизация, создание заявки): sqlite - переживают перезапуск, memory - только в памяти
+FSM_STORAGE = os.getenv('fsm_storage', 'sqlite')
+# Как часто изменения состояний диалогов записываются на диск
+FSM_FLUSH_INTERVAL = float(os.getenv('fsm_flush_interval', 1))
+
+if FSM_STORAGE == 'sqlite':
+    fsm_storage = SQLiteStorage(
+        os.getenv('fsm_db_path', os.path.join(categorizer.DATA_DIR, 'fsm.db')),
+        # Незаконченный диалог, брошенный дольше этого срока, удаляется
+        ttl=float(os.getenv('fsm_state_ttl', 24 * 3600)),
+    )
+else:
+    fsm_storage = MemoryStorage()
 
 bot = Bot(token=os.getenv('TOKEN'))
-dp = Dispatcher()
+dp = Dispatcher(storage=fsm_storage)
 
 async def on_startup(bot: Bot):
     """Запускается при старте бота"""
-    asyncio.create_task(user_cmd.check_ticket_updates(bot))
+    # Сессии и отметки опроса восстанавливаются до первого цикла опроса
+    await user_cmd.restore_state()
+    asyncio.create_task(user_cmd.state_store.flush_loop(user_cmd.STATE_FLUSH_INTERVAL))
+    if isinstance(fsm_storage, SQLiteStorage):
+        # Незаконченные диалоги загружаются до первого апдейта
+        restored = await asyncio.get_running_loop().run_in_executor(None, fsm_storage.load)
+        print(f"Восстановлено незаконченных диалогов: {restored}")
+        asyncio.create_task(fsm_storage.flush_loop(FSM_FLUSH_INTERVAL))
+    if RUN_POLLER:
+        # С вебхуком GLPI изменения приходят сразу, опрос только сверяет пропущенное
+        interval = glpi_webhook.RECONCILE_INTERVAL if glpi_webhook.GLPI_WEBHOOK_SECRET else user_cmd.POLL_INTERVAL
+        asyncio.create_task(user_cmd.check_ticket_updates(bot, interval))
+    # Модель и эмбеддинги категорий загружаются в фоне, бот уже принимает сообщения
+    asyncio.get_running_loop().run_in_executor(None, categorizer.warm_up)
+    await asyncio.get_running_loop().run_in_executor(None, category_catalog.category_catalog.load)
+    asyncio.create_task(similar_tickets.index_tickets_loop())
+
+async def on_shutdown(bot: Bot):
+    """Досылает уведомления, закрывает пул соединений с GLPI, сохраняет состояние бота и диалогов, индекс заявок, каталог категорий и останавливает сервис эмбеддингов"""
+    # Накопленные сводки отправляются сразу, недоотправленные уведомления получают несколько секунд
+    await user_cmd.digest.flush_all()
+    print(f"Сводка уведомлений: {user_cmd.digest.stats()}")
+    await user_cmd.outbox.drain(timeout=5)
+    await user_cmd.outbox.stop()
+    await user_cmd.glpi.close()
+    user_cmd.state_store.flush()
+    user_cmd.state_store.close()
+    if isinstance(fsm_storage, SQLiteStorage):
+        # Dispatcher сам хранилище не закрывает: последние изменения диалогов сохраняются здесь
+        await fsm_storage.close()
+    similar_tickets.ticket_index.save()
+    category_catalog.category_catalog.save()
+    categorizer.embedding_cache.save()
+    print(f"Кэш эмбеддингов: {categorizer.embedding_cache.stats()}")
+    await categorizer.embedding_service.stop()
+
+dp.shutdown.register(on_shutdown)
 
 dp.include_routers(
         user_cmd.user_private_router
     )
 
+async def start_glpi_webhook_server():
+    """В режиме polling вебхуки GLPI принимает отдельный aiohttp-сервер"""
+    app = web.Application()
+    glpi_webhook.setup_glpi_webhook(app, bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    return runner
+
 async def main(): 
     await bot.delete_webhook(drop_pending_updates=True)
     await on_startup(bot)  # Запускаем фоновую задачу
+    runner = await start_glpi_webhook_server() if glpi_webhook.GLPI_WEBHOOK_SECRET else None
     
-    await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES)
+    try:
+        await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+
+async def on_webhook_startup(bot: Bot):
+    await on_startup(bot)
+    if WEBHOOK_REGISTER:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=min(WEBHOOK_CONCURRENCY, 100),
+            drop_pending_updates=True,
+        )
+
+
+def run_webhook():
+    """Принимает апдейты через вебхук: aiohttp-сервер, проверка секрета, ограничение параллельности"""
+    if not WEBHOOK_SECRET:
+        raise SystemExit("Для режима webhook задайте webhook_secret")
+    if WEBHOOK_REGISTER and not WEBHOOK_URL:
+        raise SystemExit("Для регистрации вебхука задайте webhook_url")
+
+    limiter = ConcurrencyLimitMiddleware(WEBHOOK_CONCURRENCY)
+    dp.update.outer_middleware(limiter)
+    dp.startup.register(on_webhook_startup)
+
+    async def health(request: web.Request) -> web.Response:
+        # Для проверок балансировщика
+        return web.json_response({'in_flight': limiter.in_flight, 'handled': limiter.handled})
+
+    app = web.Application()
+    app.router.add_get('/health', health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    if glpi_webhook.GLPI_WEBHOOK_SECRET:
+        glpi_webhook.setup_glpi_webhook(app, bot)
+    setup_application(app, dp, bot=bot)
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
 
 
-asyncio.run(main())
\ No newline at end of file
+if BOT_MODE == 'webhook':
+    run_webhook()
+else:
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,111 @@
+import asyncio
+import hmac
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot
+
+from handlers import user_cmd
+from utils.glpi_signature import SIGNATURE_HEADER, TIMESTAMP_HEADER, sign_payload
+
+# Секрет вебхука, заданный в GLPI (Настройка > Вебхуки); без него прием событий выключен
+GLPI_WEBHOOK_SECRET = os.getenv('glpi_webhook_secret')
+GLPI_WEBHOOK_PATH = os.getenv('glpi_webhook_path', '/glpi/webhook')
+# Насколько время подписи может отличаться от текущего (защита от повтора запросов)
+GLPI_WEBHOOK_MAX_SKEW = float(os.getenv('glpi_webhook_max_skew', 300))
+# С вебхуком опрос GLPI нужен только как страховка от потерянных событий
+RECONCILE_INTERVAL = float(os.getenv('glpi_reconcile_interval', 300))
+
+
+def verify_signature(body: bytes, timestamp: Optional[str], signature: Optional[str], secret: str) -> bool:
+    if not timestamp or not signature or not timestamp.isdigit():
+        return False
+    if abs(time.time() - int(timestamp)) > GLPI_WEBHOOK_MAX_SKEW:
+        return False
+    return hmac.compare_digest(sign_payload(body, timestamp, secret), signature.lower())
+
+
+def ticket_id_from_payload(payload) -> Optional[int]:
+    """ID заявки из события GLPI: сама заявка, комментарий (ITILFollowup) или задача заявки"""
+    if not isinstance(payload, dict):
+        return None
+    item = payload.get('item', payload)
+    if not isinstance(item, dict):
+        return None
+    itemtype = item.get('itemtype') or payload.get('itemtype')
+    if itemtype == 'Ticket' and item.get('items_id'):
+        ticket_id = item.get('items_id')
+    elif item.get('tickets_id'):
+        ticket_id = item.get('tickets_id')
+    elif payload.get('itemtype', 'Ticket') == 'Ticket':
+        ticket_id = item.get('id')
+    else:
+        return None
+    try:
+        return int(ticket_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class TicketEventQueue:
+    """Обработка событий заявок: по одной задаче на заявку.
+
+    События, пришедшие, пока заявка обрабатывается, не запускают параллельную
+    обработку, а объединяются в один повтор - GLPI часто шлет несколько событий
+    подряд (изменение заявки и комментарий).
+    """
+
+    def __init__(self, handler: Callable[[int], Awaitable[None]]):
+        self.handler = handler
+        self.received = 0
+        self.processed = 0
+        self._running: Dict[int, asyncio.Task] = {}
+        self._dirty: Set[int] = set()
+
+    def push(self, ticket_id: int):
+        self.received += 1
+        if ticket_id in self._running:
+            self._dirty.add(ticket_id)
+            return
+        self._running[ticket_id] = asyncio.create_task(self._process(ticket_id))
+
+    async def _process(self, ticket_id: int):
+        try:
+            while True:
+                self._dirty.discard(ticket_id)
+                try:
+                    await self.handler(ticket_id)
+                except Exception as e:
+                    print(f"Ошибка обработки события GLPI по заявке {ticket_id}: {str(e)}")
+                self.processed += 1
+                if ticket_id not in self._dirty:
+                    break
+        finally:
+            self._running.pop(ticket_id, None)
+
+
+def setup_glpi_webhook(app: web.Application, bot: Bot, secret: str = GLPI_WEBHOOK_SECRET):
+    """Регистрирует в aiohttp-приложении прием вебхуков GLPI"""
+    events = TicketEventQueue(lambda ticket_id: user_cmd.process_ticket_event(bot, ticket_id))
+
+    async def handle(request: web.Request) -> web.Response:
+        body = await request.read()
+        if not verify_signature(
+            body, request.headers.get(TIMESTAMP_HEADER), request.headers.get(SIGNATURE_HEADER), secret
+        ):
+            return web.Response(status=401)
+        try:
+            ticket_id = ticket_id_from_payload(json.loads(body))
+        except ValueError:
+            return web.Response(status=400)
+        if ticket_id is not None:
+            # GLPI ждет ответа синхронно, поэтому заявка обрабатывается в фоне
+            events.push(ticket_id)
+        return web.Response(status=202)
+
+    app['glpi_events'] = events
+    app.router.add_post(GLPI_WEBHOOK_PATH, handle)
+    return events
@@ -0,0 +1,38 @@
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+# Фильтры списка заявок: значение критерия статуса в поиске GLPI -> подпись кнопки
+TICKET_STATUS_FILTERS = {
+    'all': "Все",
+    'notold': "Открытые",
+    'process': "В работе",
+    '4': "В ожидании",
+    'old': "Решенные",
+}
+
+
+class TicketsPage(CallbackData, prefix='tickets'):
+    page: int
+    status: str = 'all'
+
+
+def tickets_pagination(page: int, status: str, has_next: bool) -> InlineKeyboardMarkup:
+    """Кнопки листания списка заявок и фильтры по статусу"""
+    builder = InlineKeyboardBuilder()
+
+    navigation = []
+    if page > 0:
+        navigation.append(("⬅️ Назад", TicketsPage(page=page - 1, status=status)))
+    navigation.append((f"Стр. {page + 1}", TicketsPage(page=page, status=status)))
+    if has_next:
+        navigation.append(("Вперед ➡️", TicketsPage(page=page + 1, status=status)))
+    for text, callback_data in navigation:
+        builder.button(text=text, callback_data=callback_data)
+
+    for value, label in TICKET_STATUS_FILTERS.items():
+        text = f"• {label}" if value == status else label
+        builder.button(text=text, callback_data=TicketsPage(page=0, status=value))
+
+    builder.adjust(len(navigation), 3, 2)
+    return builder.as_markup()
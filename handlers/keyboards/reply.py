@@ -9,6 +9,9 @@ start_kb = ReplyKeyboardMarkup(
         ],
         [
             KeyboardButton(text="Мои заявки"),
+        ],
+        [
+            KeyboardButton(text="Сводка уведомлений"),
         ]
     ],
     resize_keyboard=True,
@@ -61,4 +64,16 @@ urgency = ReplyKeyboardMarkup(
         ]
     ],
     resize_keyboard=True,
-)
\ No newline at end of file
+)
+
+confirm_duplicate = ReplyKeyboardMarkup(
+    keyboard=[
+        [
+            KeyboardButton(text="Все равно создать"),
+        ],
+        [
+            KeyboardButton(text="Отменить заявку ❌")
+        ]
+    ],
+    resize_keyboard=True,
+)
@@ -1,23 +1,36 @@
 import os
-import requests
 import asyncio
-from datetime import datetime
-from typing import Dict, Tuple, Optional
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Tuple, Optional
 import difflib
-from aiogram import F, types, Router, Bot,Dispatcher
+from aiogram import F, types, Router, Bot
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart, Command, or_f
 from aiogram.fsm.state import StatesGroup, State, default_state
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.formatting import as_list, as_marked_section, Bold,Spoiler #Italic, as_numbered_list и тд 
-from aiogram.types import Message, FSInputFile
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, Message, FSInputFile
 from handlers.keyboards import reply
+from handlers.keyboards.inline import TicketsPage, tickets_pagination
 from filters.chat_types import ChatTypeFilter
 from utils.states import Excursion
-import base64
-from html import unescape
-import re
+from utils.glpi_client import GLPIClient, GLPIError, GLPISessionExpired
+from utils.cache import MISSING, TTLCache
+from utils.glpi_sessions import SessionManager, parse_full_session
+from utils.categorizer import DATA_DIR
+from utils.state_store import StateStore
+from utils.notifier import NotificationOutbox
+from utils.rendering import (
+    clean_html_content, clean_ticket_content, format_ticket,
+    get_impact_name, get_status_name, get_type_name, get_urgency_name, split_entries,
+)
+from utils.digest import NotificationDigest
+from utils.ticket_owners import TicketOwners, owner_externalid
+from utils.ticket_snapshots import CONTENT_PREVIEW_LENGTH, TicketSnapshot, evict_closed_snapshots, snapshots_footprint
+from utils.category_catalog import categorize_ticket, category_catalog, schedule_refresh
+from utils import similar_tickets
 
 user_private_router = Router()
 user_private_router.message.filter(ChatTypeFilter(["private"]))
@@ -25,15 +38,75 @@ user_private_router.message.filter(ChatTypeFilter(["private"]))
 GLPI_URL = os.getenv('glpi_url')
 GLPI_API_KEY = os.getenv('glpi_api_key')
 
+# Общий асинхронный клиент GLPI (пул keep-alive соединений + таймауты)
+glpi = GLPIClient(
+    GLPI_URL,
+    GLPI_API_KEY,
+    timeout=float(os.getenv('glpi_timeout', 15)),
+    pool_size=int(os.getenv('glpi_pool_size', 100)),
+    max_in_flight=int(os.getenv('glpi_max_in_flight', 50)),
+)
+# Размер страницы при постраничном получении заявок (параметр range)
+TICKETS_PAGE_SIZE = int(os.getenv('glpi_page_size', 50))
+# Сколько заявок показывается на одной странице "Мои заявки"
+TICKETS_VIEW_PAGE_SIZE = int(os.getenv('tickets_view_page_size', 5))
+# Опрос заявок: интервал, число одновременно опрашиваемых пользователей и срок опроса одного пользователя
+POLL_INTERVAL = float(os.getenv('poll_interval', 10))
+POLL_CONCURRENCY = int(os.getenv('poll_concurrency', 20))
+POLL_USER_TIMEOUT = float(os.getenv('poll_user_timeout', 60))
+# Пакетное получение комментариев: размер страницы и предел страниц за один обход
+FOLLOWUPS_PAGE_SIZE = int(os.getenv('glpi_followups_page_size', 100))
+FOLLOWUPS_MAX_PAGES = int(os.getenv('glpi_followups_max_pages', 10))
+
+# Очередь уведомлений: ограничение частоты отправки в Telegram (в целом и для одного чата)
+outbox = NotificationOutbox(
+    global_rate=float(os.getenv('telegram_rate_limit', 25)),
+    global_burst=float(os.getenv('telegram_burst', 5)),
+    per_chat_rate=float(os.getenv('telegram_chat_rate_limit', 1)),
+    per_chat_burst=float(os.getenv('telegram_chat_burst', 3)),
+    workers=int(os.getenv('notify_workers', 4)),
+    max_retries=int(os.getenv('notify_max_retries', 5)),
+    max_pending=int(os.getenv('notify_max_pending', 10000)),
+)
+
+# Кэш отображаемых имен пользователей GLPI: {ID пользователя: имя или None, если пользователя нет}
+user_names_cache = TTLCache(
+    maxsize=int(os.getenv('user_name_cache_size', 1000)),
+    ttl=float(os.getenv('user_name_cache_ttl', 3600)),
+)
+# Отсутствующие пользователи кэшируются на меньший срок
+USER_NAME_NEGATIVE_TTL = float(os.getenv('user_name_negative_ttl', 300))
+
+# Номера полей поиска GLPI (search options) для Ticket, которые использует бот
+TICKET_SEARCH_FIELDS = {
+    2: 'id',
+    1: 'name',
+    21: 'content',
+    12: 'status',
+    10: 'urgency',
+    11: 'impact',
+    14: 'type',
+    15: 'date',
+    19: 'date_mod',
+    18: 'time_to_resolve',
+}
+SEARCH_FIELD_ID = 2
+SEARCH_FIELD_STATUS = 12
+SEARCH_FIELD_DATE = 15
+SEARCH_FIELD_DATE_MOD = 19
+SEARCH_FIELD_RECIPIENT = 22  # Автор заявки (users_id_recipient)
+
+# Профили, которым видны все заявки
+STAFF_PROFILES = ('Admin', 'Super-Admin', 'Technician')
+
 bot = Bot(token=os.getenv('TOKEN'))
-storage = MemoryStorage()
-dp = Dispatcher()
 
 class NewTicketForm(StatesGroup):
     TITLE = State()        # Название заявки
     DESCRIPTION = State()  # Описание проблемы
     URGENCY = State()      # Срочность (1-5)
     TYPE = State()         # Тип заявки
+    CONFIRM = State()      # Подтверждение, если найдены похожие заявки
 
 
 class AuthForm(StatesGroup):
@@ -42,118 +115,65 @@ class AuthForm(StatesGroup):
     SESSION_TOKEN = State()
 
 # Глобальное хранилище последних состояний заявок
-last_ticket_states: Dict[int, int] = {}
+last_ticket_states: Dict[int, TicketSnapshot] = {}
+# Снимки заявок, решенных или закрытых дольше этого срока, выгружаются из памяти
+# (в хранилище состояния они остаются и догружаются, если заявку переоткроют)
+SNAPSHOT_MAX_CLOSED_AGE = float(os.getenv('snapshot_max_closed_age', 7 * 24 * 3600))
+SNAPSHOT_EVICT_INTERVAL = float(os.getenv('snapshot_evict_interval', 600))
+
+# Максимальный date_mod, обработанный при опросе, для каждого пользователя Telegram
+ticket_watermarks: Dict[int, str] = {}
+
+# Настройки пользователей Telegram: {'digest': True} - уведомления приходят сводкой
+user_settings: Dict[int, dict] = {}
+# Окно сводки: изменения заявки за это время объединяются в одно сообщение
+DIGEST_WINDOW = float(os.getenv('digest_window', 60))
 
 async def on_startup(bot: Bot):
     """Запускается при старте бота"""
     asyncio.create_task(check_ticket_updates(bot))
 
 
-from typing import List, Dict, Tuple
-import numpy as np
-from sentence_transformers import SentenceTransformer
-
-# Инициализация модели для эмбеддингов
-model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-
-
-
-# Векторная база данных категорий
-CATEGORIES = {
-    "Авторизация": {
-        "description": "Проблемы с входом в систему, сброс пароля, блокировка учетной записи",
-        "embedding": None  # Будет заполнено при инициализации
-    },
-    "Вопросы HR": {
-        "description": "Кадровые вопросы, отпуска, больничные, оформление документов",
-        "embedding": None
-    },
-    "Вопросы о времени": {
-        "description": "График работы, табель учета времени, опоздания, перенос встреч",
-        "embedding": None
-    },
-    "Технические проблемы": {
-        "description": "Неисправности оборудования, проблемы с ПО, доступ к ресурсам",
-        "embedding": None
-    }
-}
-
-# Инициализация эмбеддингов для категорий
-def initialize_category_embeddings():
-    for category_name, category_data in CATEGORIES.items():
-        # Создаем эмбеддинг для названия категории и ее описания
-        text = f"{category_name}: {category_data['description']}"
-        CATEGORIES[category_name]['embedding'] = model.encode(text)
-
-initialize_category_embeddings()
-
-def find_best_category(title: str, description: str) -> Tuple[str, float]:
-    """
-    Находит наиболее подходящую категорию для заявки на основе названия и описания.
-    Возвращает название категории и score сходства (0-1).
-    """
-    if not title and not description:
-        return "Другое", 0.0
-    
-    # Создаем эмбеддинг для входного текста
-    input_text = f"{title}: {description}"
-    input_embedding = model.encode(input_text)
-    
-    best_category = "Другое"
-    best_score = 0.0
-    
-    # Сравниваем с каждой категорией
-    for category_name, category_data in CATEGORIES.items():
-        category_embedding = category_data['embedding']
-        if category_embedding is None:
-            continue
-            
-        # Вычисляем косинусное сходство
-        similarity = np.dot(input_embedding, category_embedding) / (
-            np.linalg.norm(input_embedding) * np.linalg.norm(category_embedding)
-        )
-        
-        if similarity > best_score:
-            best_score = similarity
-            best_category = category_name
-    
-    # Если сходство слишком низкое, возвращаем "Другое"
-    if best_score < 0.3:  # Пороговое значение можно настроить
-        return "Другое", best_score
-    
-    return best_category, best_score
+# Записывать владельца создаваемой заявки также в поле externalid заявки в GLPI
+# и читать его у заявок, владелец которых в карте еще не определен
+OWNER_EXTERNALID = os.getenv('glpi_owner_externalid', '0') == '1'
 
 # Модифицированная функция создания заявки с учетом категории
-def create_glpi_ticket(session_token: str, ticket_data: dict, telegram_id: int) -> bool:
-    url = f"{GLPI_URL}/Ticket"
-    headers = {
-        "Content-Type": "application/json",
-        "App-Token": GLPI_API_KEY,
-        "Session-Token": session_token
-    }
-    
-    # Определяем категорию заявки
-    category, score = find_best_category(ticket_data['title'], ticket_data['description'])
+async def create_glpi_ticket(session_token: str, ticket_data: dict, telegram_id: int) -> Optional[int]:
+    """Создает заявку в GLPI и возвращает ее ID (None при ошибке)"""
+    # Подбираем категорию GLPI из каталога: инференс выполняется вне цикла событий
+    try:
+        category_id, category, score = await categorize_ticket(
+            ticket_data['title'], ticket_data['description'], ticket_data['type']
+        )
+    except Exception as e:
+        print(f"Ошибка определения категории: {str(e)}")
+        category_id, category, score = 0, "Другое", 0.0
     content = f"Заявка от пользователя Telegram (ID: {telegram_id})\n\n"
     content += f"Категория (определено автоматически): {category}\n\n"
     content += f"Описание проблемы:\n{ticket_data['description']}"
     data = {
-        "input": {
-            "name": ticket_data['title'],
-            "content": content,
-            "urgency": ticket_data['urgency'],
-            "type": ticket_data['type'],
-            "itilcategories_id": 1  # Пример категории (можно настроить маппинг)
-        }
+        "name": ticket_data['title'],
+        "content": content,
+        "urgency": ticket_data['urgency'],
+        "type": ticket_data['type'],
+        "itilcategories_id": category_id
     }
+    if OWNER_EXTERNALID:
+        data["externalid"] = owner_externalid(telegram_id)
     print(f"сходство: {score:.2f}")
     print(data)
     try:
-        response = requests.post(url, headers=headers, json=data)
-        return response.status_code == 201
+        status, response = await glpi.add_item(session_token, 'Ticket', data)
+        if status == 201 and isinstance(response, dict):
+            ticket_id = response.get('id')
+            if ticket_id:
+                ticket_owners.set(ticket_id, telegram_id)
+            return ticket_id
+        return None
     except Exception as e:
         print(f"Ошибка создания заявки: {str(e)}")
-        return False
+        return None
 
 # ... (остальной код остается без изменений)
 
@@ -172,7 +192,21 @@ async def process_login(message: Message, state: FSMContext):
     await state.set_state(AuthForm.PASSWORD)
     await message.answer("Введите ваш пароль:")
 
-user_sessions = {}
+# Состояние, которое переживает перезапуск: сессии (токены зашифрованы ключом
+# state_encryption_key), состояния заявок и отметки опроса
+state_store = StateStore(
+    os.getenv('state_db_path', os.path.join(DATA_DIR, 'state.db')),
+    encryption_key=os.getenv('state_encryption_key'),
+)
+# Как часто накопленные изменения состояния записываются на диск
+STATE_FLUSH_INTERVAL = float(os.getenv('state_flush_interval', 5))
+
+# Сессии GLPI пользователей: токен + кэш glpiID, профиля и сущностей
+user_sessions = SessionManager(store=state_store)
+# Владельцы заявок, созданных через бота: ID заявки -> Telegram ID
+ticket_owners = TicketOwners(store=state_store)
+# Токен, отвергнутый GLPI, сразу помечает сессию устаревшей
+glpi.on_session_invalid = user_sessions.mark_stale
 
 # Шаг 2: Получение пароля и попытка авторизации
 @user_private_router.message(AuthForm.PASSWORD)
@@ -182,11 +216,14 @@ async def process_password(message: Message, state: FSMContext):
     password = message.text
     
     # Пытаемся авторизоваться и получить session_token + профиль
-    session_data = init_session_with_auth(login, password)
+    session_data = await init_session_with_auth(login, password)
     
     if session_data:
         # Сохраняем в глобальное хранилище
         user_sessions[message.from_user.id] = session_data
+        # Каталог категорий загружается с первой доступной сессией
+        if not category_catalog.categories:
+            schedule_refresh(glpi, session_data['session_token'], force=True)
         await message.answer(f"✅ Вы успешно авторизованы как {session_data['profile']}!")
         await message.answer("Выберите действие", reply_markup=reply.start_kb)
     else:
@@ -198,89 +235,81 @@ async def process_password(message: Message, state: FSMContext):
 
     await state.clear()
 
-def init_session_with_auth(login: str, password: str) -> dict:
+async def restore_state():
+    """Загружает при старте сессии, отметки опроса и владельцев заявок; состояния заявок догружаются по мере опроса"""
+    loop = asyncio.get_running_loop()
+    if state_store.fernet is None:
+        print("state_encryption_key не задан: сессии не сохраняются между перезапусками")
+    try:
+        user_sessions.restore(await loop.run_in_executor(None, state_store.load_sessions))
+        ticket_watermarks.update(await loop.run_in_executor(None, state_store.load_watermarks))
+        user_settings.update(await loop.run_in_executor(None, state_store.load_settings))
+        ticket_owners.restore(await loop.run_in_executor(None, state_store.load_owners))
+        print(
+            f"Восстановлено сессий: {len(user_sessions)}, отметок опроса: {len(ticket_watermarks)}, "
+            f"владельцев заявок: {len(ticket_owners)}"
+        )
+    except Exception as e:
+        print(f"Ошибка восстановления состояния бота: {str(e)}")
+
+async def restore_ticket_states(ticket_ids: list):
+    """Догружает из хранилища состояния заявок, которых еще нет в памяти"""
+    missing = [ticket_id for ticket_id in ticket_ids if ticket_id not in last_ticket_states]
+    if not missing:
+        return
+    states = await asyncio.get_running_loop().run_in_executor(None, state_store.load_ticket_states, missing)
+    for ticket_id, state in states.items():
+        # Пока шел запрос, состояние могла записать параллельная задача опроса
+        last_ticket_states.setdefault(ticket_id, TicketSnapshot.from_dict(state))
+
+def evict_ticket_snapshots():
+    """Выгружает из памяти снимки давно закрытых заявок и сообщает объем хранилища снимков"""
+    evicted = evict_closed_snapshots(last_ticket_states, SNAPSHOT_MAX_CLOSED_AGE)
+    footprint = snapshots_footprint(last_ticket_states)
+    print(
+        f"Снимки заявок: {footprint['count']} (закрытых {footprint['closed']}), "
+        f"{footprint['bytes'] / 1024:.1f} КБ; выгружено {len(evicted)}"
+    )
+
+async def init_session_with_auth(login: str, password: str) -> dict:
     """Авторизация в GLPI и получение session_token + профиля пользователя"""
-    url = f'{GLPI_URL}/initSession'
-    headers = {
-        'Content-Type': 'application/json',
-        'App-Token': GLPI_API_KEY,
-        'Authorization': f'Basic {base64.b64encode(f"{login}:{password}".encode()).decode()}'
-    }
-    
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code in (200, 206):
-            session_token = response.json().get('session_token')
+        status, data = await glpi.init_session(login, password)
+        if status in (200, 206):
+            session_token = data.get('session_token') if isinstance(data, dict) else None
             if not session_token:
                 return None
             
-            # Получаем информацию о профиле пользователя
-            profile = get_glpi_user_profile(session_token)
-            if not profile:
+            # Получаем профиль, glpiID и сущности один раз на всю сессию
+            session_info = await get_glpi_session_info(session_token)
+            if not session_info:
                 return None
                 
             return {
                 'session_token': session_token,
-                'profile': profile
+                **session_info
             }
         else:
-            print(f"Ошибка авторизации: {response.status_code}, {response.text}")
+            print(f"Ошибка авторизации: {status}, {data}")
             return None
     except Exception as e:
         print(f"Ошибка подключения: {str(e)}")
         return None
 
-def get_glpi_user_profile(session_token: str) -> str:
-    """Определяет профиль пользователя в GLPI"""
-    url = f"{GLPI_URL}/getFullSession/"
-    headers = {
-        "Content-Type": "application/json",
-        "App-Token": GLPI_API_KEY,
-        "Session-Token": session_token
-    }
-    
+async def get_glpi_session_info(session_token: str) -> dict:
+    """Определяет профиль, glpiID и активные сущности пользователя в GLPI"""
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            profile_name = response.json().get('session', {}).get('glpiactiveprofile', {}).get('name', 'Normal')
-            print(f"Профиль пользователя: {profile_name}")
+        status, data = await glpi.get_full_session(session_token)
+        if status == 200:
+            session_info = parse_full_session(data)
+            print(f"Профиль пользователя: {session_info['profile']}")
             
-            return profile_name
-        return "Normal"
+            return session_info
+        return {'profile': "Normal"}
     except Exception as e:
         print(f"Ошибка получения профиля: {str(e)}")
-        return "Normal"
-
-def get_glpi_tickets(session_token):
-    print(session_token)
-    if not session_token:
-        return None
-    
-    url = f'{GLPI_URL}/Ticket'
-    headers = {
-        'Content-Type': 'application/json',
-        'App-Token': GLPI_API_KEY,
-        'Session-Token': session_token
-    }
+        return {'profile': "Normal"}
 
-     # Параметры для фильтрации (можно настроить под свои нужды)
-    params = {
-        # 'range': '0-10',  # Получаем первые 10 заявок
-        'order': 'DESC',  # Сортировка по убыванию (новые сначала)
-        'sort': 'id',     # Сортировка по ID (правильное имя поля)
-    }
-    
-    try:
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code in (200, 206):
-            return response.json() or []
-        else:
-            print(f"Ошибка при получении заявок: {response.status_code}, {response.text}")
-            return None
-    except Exception as e:
-        print(f"Ошибка подключения: {str(e)}")
-        return None
-    
 #отмена процесса создания заявки
 @user_private_router.message(F.text.lower() == "отменить заявку ❌")
 async def cmd_cancel(message: Message, state: FSMContext):
@@ -340,84 +369,239 @@ async def process_type(message: Message, state: FSMContext):
         # Получаем все данные
         data = await state.get_data()
         
-        # Создаем заявку в GLPI
-         # Получаем токен из хранилища
+        # Перед созданием предупреждаем о вероятных дублях
         session_data = user_sessions.get(message.from_user.id)
-        session_token = session_data.get('session_token') if session_data else None 
-
-        if session_token:
-            success = create_glpi_ticket(session_token, data, message.from_user.id)
-            if success:
-                await message.answer("✅ Заявка успешно создана!", reply_markup=reply.start_kb)
-            else:
-                await message.answer("❌ Ошибка при создании заявки")
-        else:
-            await message.answer("❌ Ошибка авторизации в GLPI")
+        if session_data:
+            duplicates = await find_duplicate_tickets(session_data, data, message.from_user.id)
+            if duplicates:
+                await state.set_state(NewTicketForm.CONFIRM)
+                await message.answer(format_duplicates(duplicates), reply_markup=reply.confirm_duplicate)
+                return
         
-        await state.clear()
+        await finalize_ticket(message, state)
     else:
         await message.answer("Пожалуйста, выберите тип из предложенных вариантов")
 
-def get_user_tickets(session_data: dict, telegram_id: int) -> list:
-    """Получает заявки пользователя с проверкой:
-    1. Если есть Telegram ID в заявке - проверяем совпадение и по Telegram ID и по GLPI ID
-    2. Если нет Telegram ID в заявке - проверяем только по GLPI ID
-    3. Для админов показывает все заявки"""
-    if not session_data:
-        return None
+# Шаг 6 (если найдены похожие заявки): подтверждение создания
+@user_private_router.message(NewTicketForm.CONFIRM)
+async def process_confirm(message: Message, state: FSMContext):
+    if message.text and message.text.lower() == "все равно создать":
+        await finalize_ticket(message, state)
+    else:
+        await message.answer("Пожалуйста, выберите вариант на клавиатуре", reply_markup=reply.confirm_duplicate)
+
+async def find_duplicate_tickets(session_data: dict, data: dict, telegram_id: int) -> list:
+    """Ищет похожие заявки в индексе; ошибки поиска не мешают созданию заявки"""
+    try:
+        return await similar_tickets.find_similar(
+            f"{data['title']}: {data['description']}",
+            telegram_id,
+            see_all=session_data.get('profile') in STAFF_PROFILES,
+        )
+    except Exception as e:
+        print(f"Ошибка поиска похожих заявок: {str(e)}")
+        return []
+
+def format_duplicates(duplicates: list) -> str:
+    lines = ["🔎 Похоже, такая заявка уже есть:", ""]
+    for ticket_id, score, meta in duplicates:
+        lines.append(
+            f"🔹 #{ticket_id} {meta.get('name') or 'Без названия'}\n"
+            f"🔄 Статус: {get_status_name(meta.get('status', 0))} (сходство {score:.0%})"
+        )
+    lines.extend(["", "Создать новую заявку все равно?"])
+    return "\n".join(lines)
+
+async def finalize_ticket(message: Message, state: FSMContext):
+    """Создает заявку в GLPI по данным диалога и добавляет ее в индекс похожих заявок"""
+    data = await state.get_data()
     
-    session_token = session_data.get('session_token')
-    profile = session_data.get('profile', 'Normal')
+    # Создаем заявку в GLPI
+     # Получаем токен из хранилища
+    session_data = user_sessions.get(message.from_user.id)
+    session_token = session_data.get('session_token') if session_data else None 
+
+    if session_token:
+        ticket_id = await create_glpi_ticket(session_token, data, message.from_user.id)
+        if ticket_id:
+            await message.answer("✅ Заявка успешно создана!", reply_markup=reply.start_kb)
+            try:
+                await similar_tickets.add_ticket(
+                    ticket_id,
+                    f"{data['title']}: {data['description']}",
+                    {'name': data['title'], 'status': 1, 'owner': message.from_user.id},
+                )
+            except Exception as e:
+                print(f"Ошибка индексации новой заявки {ticket_id}: {str(e)}")
+        else:
+            await message.answer("❌ Ошибка при создании заявки")
+    else:
+        await message.answer("❌ Ошибка авторизации в GLPI")
     
-    # Для администраторов и техников показываем все заявки
-    if profile in ('Admin', 'Super-Admin', 'Technician' ):
-        return get_glpi_tickets(session_token)
+    await state.clear()
+
+async def fetch_owner_externalids(session_token: str, tickets: list):
+    """Дополняет полем externalid заявки, владелец которых еще не определен, одним запросом.
     
-    # Для обычных пользователей — строгая проверка
-    glpi_user_id = get_glpi_user_id(session_token)
-    if not glpi_user_id:
-        return None
-        
-    all_tickets = get_glpi_tickets(session_token)
-    if not all_tickets:
-        return None
+    /search/Ticket этого поля не отдает; запрос нужен только один раз на заявку,
+    дальше владелец берется из карты владельцев
+    """
+    if not OWNER_EXTERNALID or not session_token:
+        return
+    unknown = {
+        ticket['id']: ticket for ticket in tickets
+        if ticket.get('id') and 'externalid' not in ticket and not ticket_owners.known(ticket['id'])
+    }
+    if not unknown:
+        return
+    try:
+        status, items = await glpi.get_multiple_items(session_token, [('Ticket', ticket_id) for ticket_id in unknown])
+        if status not in (200, 206) or not isinstance(items, list):
+            print(f"Ошибка пакетного получения заявок: {status} {items}")
+            return
+        for item in items:
+            if isinstance(item, dict) and item.get('id') in unknown:
+                unknown[item['id']]['externalid'] = item.get('externalid')
+    except Exception as e:
+        print(f"Ошибка пакетного получения заявок: {str(e)}")
+
+def search_row_to_ticket(row: dict) -> dict:
+    """Строка /search/Ticket (ключи - номера полей) -> заявка с именами полей"""
+    return {
+        field_name: row.get(str(field_id))
+        for field_id, field_name in TICKET_SEARCH_FIELDS.items()
+    }
+
+def build_ticket_criteria(
+    glpi_user_id: Optional[int] = None,
+    status=None,
+    created_since: Optional[str] = None,
+) -> list:
+    """Критерии поиска заявок: автор, статус (номер или 'notold', 'notclosed' и т.п.)
+    и дата открытия"""
+    criteria = []
+    if glpi_user_id:
+        criteria.append({'field': SEARCH_FIELD_RECIPIENT, 'searchtype': 'equals', 'value': glpi_user_id})
+    if status is not None:
+        criteria.append({'field': SEARCH_FIELD_STATUS, 'searchtype': 'equals', 'value': status})
+    if created_since:
+        criteria.append({'field': SEARCH_FIELD_DATE, 'searchtype': 'morethan', 'value': created_since})
+    for criterion in criteria[1:]:
+        criterion['link'] = 'AND'
+    return criteria
+
+def and_criteria(criteria: list, *extra: dict) -> list:
+    """Добавляет к критериям поиска условия через AND"""
+    combined = list(criteria)
+    for criterion in extra:
+        combined.append({**criterion, 'link': 'AND'} if combined else dict(criterion))
+    return combined
+
+async def iter_modified_ticket_pages(
+    session_token: str,
+    criteria: list,
+    modified_after: Optional[str] = None,
+    page_size: int = TICKETS_PAGE_SIZE,
+) -> AsyncIterator[list]:
+    """Страницы заявок с date_mod > modified_after по возрастанию date_mod.
     
-    user_tickets = []
-    for ticket in all_tickets:
-        # Заявка должна принадлежать текущему пользователю по GLPI ID
-        if ticket.get('users_id_recipient') != glpi_user_id:
-            continue
-            
-        ticket_content = ticket.get('content', '')
-        telegram_id_in_ticket = None
-        
-        # Пытаемся извлечь Telegram ID из заявки
-        match = re.search(r"Telegram \(ID: (\d+)\)", ticket_content)
-        if match:
-            telegram_id_in_ticket = int(match.group(1))
-        
-        # Если в заявке есть Telegram ID - он должен совпадать с текущим пользователем
-        if telegram_id_in_ticket is not None and telegram_id_in_ticket != telegram_id:
-            continue
+    Постраничный обход по смещению теряет строки, если заявку с уже пройденной
+    страницы изменят во время обхода: она уходит в конец выдачи и сдвигает
+    остальные. Поэтому каждая следующая страница запрашивается с начала выдачи
+    от последнего прочитанного date_mod (keyset). date_mod хранится с точностью
+    до секунды, поэтому секунда, на которой оборвалась страница, дочитывается
+    отдельно по возрастанию ID.
+    """
+    if not session_token:
+        return
+    fields = list(TICKET_SEARCH_FIELDS)
+    after = modified_after
+    try:
+        while True:
+            page_criteria = criteria
+            if after:
+                page_criteria = and_criteria(
+                    criteria, {'field': SEARCH_FIELD_DATE_MOD, 'searchtype': 'morethan', 'value': after}
+                )
+            rows, _ = await glpi.search_page(
+                session_token, 'Ticket', page_criteria, fields, 0, page_size,
+                sort=SEARCH_FIELD_DATE_MOD, order='ASC',
+            )
+            tickets = [search_row_to_ticket(row) for row in rows]
+            last_second = tickets[-1].get('date_mod') if tickets else None
+            if len(tickets) < page_size or not last_second:
+                if tickets:
+                    yield tickets
+                return
             
-        # Если дошли сюда - заявка проходит все проверки
-        user_tickets.append(ticket)
+            yield tickets
+            # Последняя секунда страницы дочитывается целиком по ID, уже отданные заявки пропускаются
+            seen = {ticket.get('id') for ticket in tickets if ticket.get('date_mod') == last_second}
+            last_id = 0
+            while True:
+                second_criteria = and_criteria(
+                    criteria,
+                    {'field': SEARCH_FIELD_DATE_MOD, 'searchtype': 'morethan',
+                     'value': shift_search_date(last_second, -1)},
+                    {'field': SEARCH_FIELD_DATE_MOD, 'searchtype': 'lessthan',
+                     'value': shift_search_date(last_second, 1)},
+                    {'field': SEARCH_FIELD_ID, 'searchtype': 'morethan', 'value': last_id},
+                )
+                rows, _ = await glpi.search_page(
+                    session_token, 'Ticket', second_criteria, fields, 0, page_size,
+                    sort=SEARCH_FIELD_ID, order='ASC',
+                )
+                tickets = [search_row_to_ticket(row) for row in rows]
+                if tickets:
+                    last_id = max(int(ticket['id']) for ticket in tickets)
+                    unseen = [ticket for ticket in tickets if ticket.get('id') not in seen]
+                    if unseen:
+                        yield unseen
+                if len(tickets) < page_size:
+                    break
+            after = last_second
+    except Exception as e:
+        print(f"Ошибка поиска измененных заявок: {str(e)}")
+
+async def get_modified_ticket_pages(
+    session_data: dict,
+    telegram_id: int,
+    modified_after: Optional[str] = None,
+    status=None,
+    created_since: Optional[str] = None,
+) -> AsyncIterator[list]:
+    """Страницы заявок пользователя с date_mod > modified_after по возрастанию date_mod.
+    Сотрудникам видны все заявки, обычному пользователю - только свои по GLPI ID,
+    кроме созданных через бота от имени другого пользователя Telegram"""
+    session_token = session_data.get('session_token') if session_data else None
+    if not session_token:
+        return
     
-    return user_tickets
-
-def get_glpi_user_id(session_token: str) -> Optional[int]:
-    """Получает ID текущего пользователя в GLPI"""
-    url = f"{GLPI_URL}/getFullSession/"
-    headers = {
-        "Content-Type": "application/json",
-        "App-Token": GLPI_API_KEY,
-        "Session-Token": session_token
-    }
+    glpi_user_id = None
+    if session_data.get('profile', 'Normal') not in STAFF_PROFILES:
+        glpi_user_id = session_data.get('glpi_id')
+        if not glpi_user_id:
+            glpi_user_id = await get_glpi_user_id(session_token)
+            if not glpi_user_id:
+                return
+            session_data['glpi_id'] = glpi_user_id
     
+    criteria = build_ticket_criteria(glpi_user_id, status, created_since)
+    async for page in iter_modified_ticket_pages(session_token, criteria, modified_after):
+        # Владелец нужен и для отбора, и для уведомлений при опросе
+        await fetch_owner_externalids(session_token, page)
+        if glpi_user_id:
+            # Заявки, созданные ботом от имени другого пользователя Telegram, пропускаем
+            page = [ticket for ticket in page if ticket_owners.resolve(ticket) in (None, telegram_id)]
+        if page:
+            yield page
+
+async def get_glpi_user_id(session_token: str) -> Optional[int]:
+    """Получает ID текущего пользователя в GLPI"""
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json().get('session', {}).get('glpiID')
+        status, data = await glpi.get_full_session(session_token)
+        if status == 200:
+            return data.get('session', {}).get('glpiID')
         return None
     except Exception as e:
         print(f"Ошибка получения ID пользователя GLPI: {str(e)}")
@@ -427,7 +611,6 @@ def get_glpi_user_id(session_token: str) -> Optional[int]:
 # Просмотр заявок
 @user_private_router.message(F.text.lower() == "мои заявки")
 async def cmd_my_tickets(message: Message):
-    await message.answer("Получаю список заявок...")
     session_data = user_sessions.get(message.from_user.id)
     
     if not session_data:
@@ -435,134 +618,135 @@ async def cmd_my_tickets(message: Message):
         return
     
     try:
-        tickets = get_user_tickets(session_data, message.from_user.id)
-        print("заявка: ", tickets)
-        if not tickets:
-            await message.answer("🚫 Нет доступных заявок")
-            return
-        response = "📋 Ваши последние заявки:\n\n" + \
-                  "\n".join([format_ticket(t) for t in tickets[:10]])
-        
-        await message.answer(response[:4000])
-        
+        messages, keyboard = await render_tickets_page(session_data, message.from_user.id, 0, 'all')
+        for text in messages[:-1]:
+            await message.answer(text)
+        await message.answer(messages[-1], reply_markup=keyboard)
     except Exception as e:
         await message.answer("⚠️ Произошла ошибка при получении заявок")
         print(f"Ошибка: {str(e)}") 
 
-def format_ticket(ticket):
-     # Обрезаем длинное описание до 200 символов
-    content = clean_html_content(ticket.get('content', 'Нет описания'))
-
-    # Добавляем переносы строк для ключевых частей
-    formatted_content = content.replace(
-        "Заявка от пользователя Telegram", 
-        "\nЗаявка от пользователя Telegram"
-    ).replace(
-        "Категория (определено автоматически):", 
-        "\nКатегория (определено автоматически):"
-    ).replace(
-        "Описание проблемы:", 
-        "\nОписание проблемы:"
-    )
+# Листание списка заявок и фильтр по статусу
+@user_private_router.callback_query(TicketsPage.filter())
+async def tickets_page_callback(callback: CallbackQuery, callback_data: TicketsPage):
+    session_data = user_sessions.get(callback.from_user.id)
+    if not session_data:
+        await callback.answer("❌ Вы не авторизованы в GLPI", show_alert=True)
+        return
+    
+    try:
+        messages, keyboard = await render_tickets_page(
+            session_data, callback.from_user.id, callback_data.page, callback_data.status
+        )
+    except Exception as e:
+        await callback.answer("⚠️ Произошла ошибка при получении заявок", show_alert=True)
+        print(f"Ошибка: {str(e)}")
+        return
+    await callback.answer()
+    
+    try:
+        # Страница из одного сообщения заменяет предыдущую на месте
+        if len(messages) == 1:
+            await callback.message.edit_text(messages[0], reply_markup=keyboard)
+            return
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except TelegramBadRequest as e:
+        # Та же страница повторно (кнопка с номером страницы) - сообщение не изменилось
+        if 'message is not modified' in str(e):
+            return
+        print(f"Не удалось обновить список заявок: {str(e)}")
+    for text in messages[:-1]:
+        await callback.message.answer(text)
+    await callback.message.answer(messages[-1], reply_markup=keyboard)
+
+async def fetch_tickets_page(
+    session_data: dict, telegram_id: int, page: int, status: str = 'all'
+) -> Tuple[list, int]:
+    """Запрашивает у GLPI только одну страницу заявок пользователя: (заявки, всего заявок)"""
+    session_token = session_data.get('session_token')
+    start = page * TICKETS_VIEW_PAGE_SIZE
+    status_value = None if status == 'all' else status
     
-    short_content = (formatted_content[:200] + '...') if len(formatted_content) > 200 else formatted_content
-    
-    return (
-        f"🔹 #{ticket.get('id', 'N/A')}\n"
-        f"📌 Тема: {ticket.get('name', 'Без названия')}\n"
-        f"📝 Описание: {short_content}\n"
-        f"🔄 Статус: {get_status_name(ticket.get('status', 0))}\n"
-        f"📅 Дата создания: {ticket.get('date', 'N/A')}\n"
-        f"⚠️ Срочность: {get_urgency_name(ticket.get('urgency', 0))}\n"
-        f"🔔 Тип: {get_type_name(ticket.get('type', 0))}\n"
-        f"────────────────────"
+    if session_data.get('profile', 'Normal') in STAFF_PROFILES:
+        if status_value is None:
+            params = {'order': 'DESC', 'sort': 'id'}
+            return await glpi.list_page(session_token, 'Ticket', params, start, TICKETS_VIEW_PAGE_SIZE)
+        glpi_user_id = None
+    else:
+        glpi_user_id = session_data.get('glpi_id')
+        if not glpi_user_id:
+            glpi_user_id = await get_glpi_user_id(session_token)
+            if not glpi_user_id:
+                return [], 0
+            session_data['glpi_id'] = glpi_user_id
+    
+    criteria = build_ticket_criteria(glpi_user_id, status_value)
+    rows, total = await glpi.search_page(
+        session_token, 'Ticket', criteria, list(TICKET_SEARCH_FIELDS),
+        start, TICKETS_VIEW_PAGE_SIZE, sort=SEARCH_FIELD_ID, order='DESC',
     )
-
-def get_status_name(status_id):
-    """Преобразует ID статуса в читаемое название"""
-    status_mapping = {
-        1: "🆕 Новая",
-        2: "🔄 В работе(назначена)", 
-        3: "☑️ В работе(запланирована)",
-        4: "⏳ В ожидании",
-        5: "✅ Решена",
-        6: "❌ Закрыта"  
-    }
-    return status_mapping.get(status_id, f"❓ Неизвестный статус ({status_id})")
-
-def get_urgency_name(urgency_id):
-    urgency_mapping = {
-        1: "🟢 Очень низкая",
-        2: "🟡 Низкая",
-        3: "🟠 Средняя",
-        4: "🚨 Высокая",
-        5: "⚡ Очень высокая"
-    }
-    return urgency_mapping.get(urgency_id, f"❓ Неизвестная срочность ({urgency_id})")
-
-def get_impact_name(impact_id):
-    impact_mapping = {
-        1: "🟢 Очень низкое",
-        2: "🟡 Низкое",
-        3: "🟠 Среднее",
-        4: "🚨 Высокое",
-        5: "⚡ Очень высокое"
-    }
-    return impact_mapping.get(impact_id, f"❓ Неизвестное влияение ({impact_id})")
-
-def get_type_name(type_id):
-    type_mapping = {
-        1: "Инцидент",
-        2: "Запрос"
-    }
-    return type_mapping.get(type_id, f"❓ Неизвестный тип ({type_id})")
-
-def clean_html_content(text):
-    """Удаляет HTML-теги и преобразует HTML-сущности в нормальные символы"""
-    if not text:
-        return ""
+    tickets = [search_row_to_ticket(row) for row in rows]
+    if glpi_user_id:
+        await fetch_owner_externalids(session_token, tickets)
+        # Заявки, созданные ботом от имени другого пользователя Telegram, не показываем
+        tickets = [
+            ticket for ticket in tickets
+            if ticket_owners.resolve(ticket) in (None, telegram_id)
+        ]
+    return tickets, total
+
+async def render_tickets_page(
+    session_data: dict, telegram_id: int, page: int, status: str
+) -> Tuple[list, Optional[types.InlineKeyboardMarkup]]:
+    """Тексты сообщений страницы (разбиты по границам заявок) и клавиатура листания"""
+    try:
+        tickets, total = await fetch_tickets_page(session_data, telegram_id, page, status)
+    except GLPISessionExpired:
+        tickets, total = [], 0
     
-    # Заменяем HTML-сущности на соответствующие символы
-    text = unescape(text)
+    if session_data.get('stale'):
+        session_data['stale_notified'] = True
+        user_sessions.save(telegram_id)
+        return ["⚠️ Сессия GLPI истекла. Авторизуйтесь заново: /start"], None
     
-    # Удаляем HTML-теги
-    text = re.sub(r'<[^>]+>', '', text)
+    has_next = (page + 1) * TICKETS_VIEW_PAGE_SIZE < total
+    keyboard = tickets_pagination(page, status, has_next)
+    if not tickets:
+        return ["🚫 Нет доступных заявок"], keyboard
     
-    # Удаляем лишние пробелы и переносы строк
-    text = ' '.join(text.split())
+    pages_total = (total + TICKETS_VIEW_PAGE_SIZE - 1) // TICKETS_VIEW_PAGE_SIZE
+    header = f"📋 Ваши заявки (страница {page + 1} из {pages_total}, всего {total}):\n"
+    return split_entries(header, [format_ticket(ticket) for ticket in tickets]), keyboard
+
+# Переключение режима сводки уведомлений
+@user_private_router.message(or_f(Command("digest"), F.text.lower() == "сводка уведомлений"))
+async def cmd_toggle_digest(message: Message):
+    telegram_id = message.from_user.id
+    settings = user_settings.setdefault(telegram_id, {})
+    settings['digest'] = not settings.get('digest', False)
+    state_store.save_settings(telegram_id, settings)
     
-    return text
-
+    if settings['digest']:
+        await message.answer(
+            f"🗂 Сводка включена: изменения заявки за {DIGEST_WINDOW:.0f} с придут одним сообщением"
+        )
+    else:
+        # Накопленное отправляем сразу, чтобы ничего не потерялось
+        await digest.flush_all(telegram_id)
+        await message.answer("🔔 Сводка выключена: уведомления снова приходят сразу")
 
 # Функция для получения информации о конкретной заявке
-def get_ticket_details(session_token: str, ticket_id: int) -> dict:
+async def get_ticket_details(session_token: str, ticket_id: int) -> Optional[dict]:
     """Получает детали заявки по ID"""
-    url = f"{GLPI_URL}/Ticket/{ticket_id}"
-    headers = {
-        "Content-Type": "application/json",
-        "App-Token": GLPI_API_KEY,
-        "Session-Token": session_token
-    }
-    
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
+        status, data = await glpi.get_item(session_token, 'Ticket', ticket_id)
+        if status == 200:
+            return data
         return None
     except Exception as e:
         print(f"Ошибка получения заявки {ticket_id}: {str(e)}")
         return None
 
-# Функция для поиска Telegram ID инициатора заявки
-def find_telegram_id_in_content(content: str) -> int:
-    """Ищет Telegram ID в содержимом заявки"""
-    if not content:
-        return None
-    
-    match = re.search(r"Telegram \(ID: (\d+)\)", content)
-    return int(match.group(1)) if match else None
-
-
 # Какие поля отслеживаем для изменений
 TRACKED_FIELDS = {
     'status': ('🔄 Статус', get_status_name),
@@ -570,145 +754,373 @@ TRACKED_FIELDS = {
     'impact': ('📍 Влияние', get_impact_name),
     'type': ('🔔 Тип', get_type_name),
     'name': ('📌 Тема', str),
-    'content': ('📝 Описание', lambda x: x[:100] + '...' if len(x) > 100 else x),
+    'content': ('📝 Описание', str),
     'time_to_resolve': ('⏳ Срок решения', str),
-    'comments': ('💬 Комментарии', lambda x: f"{len(x)} комментариев"),
 }
 
-def get_ticket_comments(session_token: str, ticket_id: int) -> list:
+async def get_ticket_comments(session_token: str, ticket_id: int) -> list:
     """Получает комментарии к заявке"""
-    url = f"{GLPI_URL}/Ticket/{ticket_id}/ITILFollowup"
-    headers = {
-        "Content-Type": "application/json",
-        "App-Token": GLPI_API_KEY,
-        "Session-Token": session_token
-    }
-    
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            comments_json = response.json()
-            import json
-            # print(f"Комментарии для заявки {ticket_id}:")
-            # print(json.dumps(comments_json, indent=4, ensure_ascii=False))
-            return comments_json
+        status, data = await glpi.get_sub_items(session_token, 'Ticket', ticket_id, 'ITILFollowup')
+        if status == 200:
+            return data if isinstance(data, list) else []
         else:
-            # print(f"Ошибка получения комментариев для заявки {ticket_id}: {response.status_code} {response.text}")
+            # print(f"Ошибка получения комментариев для заявки {ticket_id}: {status} {data}")
             return []
     except Exception as e:
         print(f"Ошибка получения комментариев для заявки {ticket_id}: {str(e)}")
         return []
     
     
-def get_new_comments(previous_comments: list, current_comments: list) -> list:
-    """Находит новые комментарии"""
-    if not previous_comments:
-        return current_comments
+async def get_latest_followup_id(session_token: str) -> int:
+    """Возвращает ID самого нового комментария, видимого пользователю (0, если их нет)"""
+    params = {'sort': 'id', 'order': 'DESC', 'range': '0-0'}
+    status, data, _ = await glpi.list_items(session_token, 'ITILFollowup', params=params)
+    if status in (200, 206):
+        return int(data[0]['id']) if data else 0
+    if status == 400 and isinstance(data, list) and 'ERROR_RANGE_EXCEED_TOTAL' in data:
+        return 0
+    raise GLPIError(f"Ошибка получения последнего комментария: {status} {data}")
+
+async def find_latest_followup_id(session_token: str) -> Optional[int]:
+    """Как get_latest_followup_id, но None, если общая лента комментариев профилю недоступна"""
+    try:
+        return await get_latest_followup_id(session_token)
+    except GLPISessionExpired:
+        raise
+    except GLPIError as e:
+        print(f"Общая лента комментариев недоступна: {str(e)}")
+        return None
+
+async def get_new_followups(session_token: str, after_ids: Dict[int, int]) -> Dict[int, list]:
+    """Пакетно получает новые комментарии сразу для нескольких заявок.
+    
+    after_ids - {ID заявки: ID последнего известного комментария}. Лента /ITILFollowup
+    обходится от новых комментариев к старым, пока ID не опустится до наименьшего
+    известного. Заявки, до которых обход не дошел за FOLLOWUPS_MAX_PAGES страниц,
+    догружаются по одной, как и все заявки, если ленту получить не удалось.
+    """
+    result = {ticket_id: [] for ticket_id in after_ids}
+    if not after_ids:
+        return result
     
-    previous_ids = {c['id'] for c in previous_comments}
-    return [c for c in current_comments if c['id'] not in previous_ids]
+    floor = min(after_ids.values())
+    lowest_seen = None
+    reached_floor = False
+    pages = 0
+    params = {'sort': 'id', 'order': 'DESC'}
+    try:
+        async for page in glpi.iter_items(session_token, 'ITILFollowup', params=params, page_size=FOLLOWUPS_PAGE_SIZE):
+            pages += 1
+            for followup in page:
+                followup_id = followup.get('id')
+                if followup_id <= floor:
+                    reached_floor = True
+                    break
+                # При сдвиге страниц новыми комментариями записи могут повториться
+                if lowest_seen is not None and followup_id >= lowest_seen:
+                    continue
+                lowest_seen = followup_id
+            
+                ticket_id = followup.get('items_id')
+                if followup.get('itemtype') == 'Ticket' and ticket_id in after_ids and followup_id > after_ids[ticket_id]:
+                    result[ticket_id].append(followup)
+            if reached_floor or pages >= FOLLOWUPS_MAX_PAGES:
+                break
+        else:
+            # Лента закончилась - более старых комментариев нет
+            reached_floor = True
+    except GLPISessionExpired:
+        raise
+    except GLPIError as e:
+        # Профиль может не иметь права на общую ленту /ITILFollowup - тогда комментарии берутся по заявкам
+        print(f"Ошибка получения ленты комментариев: {str(e)}")
+        result = {ticket_id: [] for ticket_id in after_ids}
+        lowest_seen = None
+        reached_floor = False
+    
+    if not reached_floor:
+        for ticket_id, after_id in after_ids.items():
+            if lowest_seen is not None and after_id >= lowest_seen - 1:
+                continue
+            comments = await get_ticket_comments(session_token, ticket_id)
+            result[ticket_id] = [c for c in comments if c.get('id', 0) > after_id]
+    
+    # Уведомления ожидают комментарии в хронологическом порядке
+    for comments in result.values():
+        comments.sort(key=lambda c: c.get('id', 0))
+    return result
+
+
+def watermark_search_value(watermark: Optional[str]) -> Optional[str]:
+    """Значение для критерия date_mod > ... с запасом в 1 секунду.
+
+    date_mod в GLPI хранится с точностью до секунды, поэтому заявки, измененные
+    в ту же секунду, что и отметка, запрашиваются повторно (без изменений они
+    не порождают уведомлений)
+    """
+    if not watermark:
+        return None
+    return shift_search_date(watermark, -1)
+
+def shift_search_date(value: str, seconds: int) -> str:
+    """Сдвигает дату GLPI (YYYY-MM-DD HH:MM:SS) на seconds секунд"""
+    try:
+        moment = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return value
+    return (moment + timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
 
 
 
-async def check_ticket_updates(bot: Bot):
-    """Периодически проверяет изменения заявок и отправляет уведомления"""
+async def process_ticket(
+    bot: Bot,
+    ticket: dict,
+    session_token: str,
+    new_comments: list,
+    baseline_followup_id: Optional[int] = None,
+):
+    """Сравнивает заявку с последним известным состоянием и отправляет уведомления.
+    
+    new_comments - комментарии новее последнего известного, полученные пакетно;
+    baseline_followup_id - ID последнего комментария в GLPI для заявок без сохраненного состояния
+    """
+    ticket_id = ticket.get('id')
+    # Описание очищается один раз на версию заявки (ID, date_mod)
+    content = clean_ticket_content(ticket)
+    
+    # Получатель уведомлений - владелец заявки из карты владельцев
+    initiator_id = ticket_owners.resolve(ticket)
+    
+    # Лента опроса пополняет индекс похожих заявок и обновляет в нем статусы
+    similar_tickets.observe_ticket(
+        ticket_id, ticket.get('name'), content, ticket.get('status'), initiator_id
+    )
+    
+    # Получаем предыдущее состояние
+    previous_data = last_ticket_states.get(ticket_id)
+    
+    # Если заявка новая, сохраняем ее состояние
+    if previous_data is None:
+        current_data = TicketSnapshot.from_ticket(ticket, content, baseline_followup_id or 0)
+        last_ticket_states[ticket_id] = current_data
+        state_store.save_ticket(ticket_id, current_data.to_dict())
+        return
+    
+    # Заявку могла уже обработать параллельная задача другого пользователя
+    last_followup_id = previous_data.last_followup_id
+    new_comments = [c for c in new_comments if c.get('id', 0) > last_followup_id]
+    current_data = TicketSnapshot.from_ticket(
+        ticket,
+        content,
+        max([last_followup_id] + [c.get('id', 0) for c in new_comments]),
+        previous_data,
+    )
+    
+    # Проверяем изменения по всем отслеживаемым полям
+    changes = detect_ticket_changes(previous_data, current_data)
+    
+    # Обновляем последнее известное состояние до отправки уведомлений:
+    # между сравнением и записью не должно быть await, иначе параллельные
+    # задачи опроса отправят одно и то же уведомление дважды
+    last_ticket_states[ticket_id] = current_data
+    state_store.save_ticket(ticket_id, current_data.to_dict())
+    
+    if not initiator_id or not (changes or new_comments):
+        return
+    
+    ticket_name = current_data.name or 'Без названия'
+    # В режиме сводки изменения копятся и уходят одним сообщением по окончании окна
+    if user_settings.get(initiator_id, {}).get('digest'):
+        digest.add(bot, initiator_id, ticket_id, ticket_name, changes, new_comments, session_token)
+        return
+    await send_notification(bot, initiator_id, ticket_id, ticket_name, changes, new_comments, session_token)
+
+async def send_notification(
+    bot: Bot,
+    user_id: int,
+    ticket_id: int,
+    ticket_name: str,
+    changes: Dict[str, Tuple],
+    comments: list,
+    session_token: str,
+):
+    """Выбирает вид уведомления по тому, что изменилось в заявке"""
+    # Если есть только новые комментарии - отправляем только уведомление о них
+    if comments and not changes:
+        await send_comment_notification(
+            bot,
+            ticket_id,
+            ticket_name,
+            comments,
+            user_id,
+            session_token  # Добавляем session_token для получения имен пользователей
+        )
+    # Если есть изменения (но нет новых комментариев) - отправляем уведомление об изменениях
+    elif changes and not comments:
+        await send_ticket_update_notification(
+            bot, 
+            ticket_id, 
+            ticket_name, 
+            changes, 
+            user_id
+        )
+    # Если есть и то и другое - отправляем комбинированное уведомление
+    elif changes and comments:
+        await send_combined_notification(
+            bot,
+            ticket_id,
+            ticket_name,
+            changes,
+            comments,
+            user_id,
+            session_token
+        )
+
+# Сводка уведомлений для пользователей, включивших режим дайджеста
+digest = NotificationDigest(send_notification, window=DIGEST_WINDOW)
+
+async def notify_stale_sessions(bot: Bot):
+    """Один раз сообщает пользователю, что его сессия GLPI истекла"""
+    for telegram_id, session_data in user_sessions.stale_items():
+        if session_data.get('stale_notified'):
+            continue
+        session_data['stale_notified'] = True
+        user_sessions.save(telegram_id)
+        outbox.enqueue(
+            bot,
+            telegram_id,
+            "⚠️ Сессия GLPI истекла. Чтобы снова получать уведомления, авторизуйтесь заново: /start",
+            description="уведомления об истекшей сессии",
+        )
+
+async def poll_user_tickets(bot: Bot, telegram_id: int, session_data: dict):
+    """Один цикл опроса заявок пользователя"""
+    session_token = session_data.get('session_token')
+    if not session_token:
+        return
+    
+    # Запрашиваем только заявки, измененные после отметки прошлого опроса.
+    # Новый комментарий тоже обновляет date_mod заявки в GLPI.
+    # Обрабатываем по одной странице выдачи: при первом опросе или потере
+    # отметки изменены все заявки, и целиком в памяти они не держатся
+    watermark = ticket_watermarks.get(telegram_id)
+    baseline_followup_id = None
+    baseline_checked = False
+    async for tickets in get_modified_ticket_pages(session_data, telegram_id, watermark_search_value(watermark)):
+        # После перезапуска состояния заявок берутся из хранилища, а не считаются новыми
+        await restore_ticket_states([ticket['id'] for ticket in tickets])
+        
+        # Новые комментарии всех заявок страницы - одним обходом ленты
+        after_ids = {
+            ticket['id']: last_ticket_states[ticket['id']].last_followup_id
+            for ticket in tickets
+            if ticket.get('id') in last_ticket_states
+        }
+        new_followups = await get_new_followups(session_token, after_ids)
+        if not baseline_checked and len(after_ids) < len(tickets):
+            baseline_checked = True
+            baseline_followup_id = await find_latest_followup_id(session_token)
+        
+        for ticket in tickets:
+            ticket_baseline_id = baseline_followup_id
+            if ticket_baseline_id is None and ticket.get('id') not in after_ids:
+                # Общая лента недоступна - последний комментарий берется у самой заявки
+                comments = await get_ticket_comments(session_token, ticket['id'])
+                ticket_baseline_id = max((comment.get('id', 0) for comment in comments), default=0)
+            await process_ticket(
+                bot,
+                ticket,
+                session_token,
+                new_followups.get(ticket.get('id'), []),
+                ticket_baseline_id,
+            )
+            
+            # Выдача отсортирована по date_mod, поэтому отметку можно сдвигать
+            # после каждой обработанной заявки
+            date_mod = ticket.get('date_mod')
+            if date_mod and (watermark is None or date_mod > watermark):
+                watermark = date_mod
+                ticket_watermarks[telegram_id] = watermark
+                state_store.save_watermark(telegram_id, watermark)
+
+async def process_ticket_event(bot: Bot, ticket_id: int):
+    """Обрабатывает заявку по событию GLPI (вебхук) так же, как опрос: сравнение с последним состоянием и уведомления"""
+    owner_id = ticket_owners.get(ticket_id)
+    session_data = user_sessions.get(owner_id) if owner_id else None
+    if not session_data or session_data.get('stale'):
+        # Уведомлять некого или нечем прочитать заявку - ее подхватит сверочный опрос
+        return
+    session_token = session_data['session_token']
+    
+    ticket = await get_ticket_details(session_token, ticket_id)
+    if ticket is None:
+        return
+    await restore_ticket_states([ticket_id])
+    # process_ticket сам отбирает комментарии новее последнего известного
+    comments = await get_ticket_comments(session_token, ticket_id)
+    baseline_followup_id = None
+    if ticket_id not in last_ticket_states:
+        # Как и при опросе, отметка - последний комментарий во всей ленте: с отметкой 0
+        # следующий пакетный обход ленты дошел бы до самого ее начала
+        baseline_followup_id = await find_latest_followup_id(session_token)
+        if baseline_followup_id is None:
+            baseline_followup_id = max((comment.get('id', 0) for comment in comments), default=0)
+    await process_ticket(bot, ticket, session_token, comments, baseline_followup_id)
+
+async def poll_user_with_limits(bot: Bot, semaphore: asyncio.Semaphore, telegram_id: int, session_data: dict):
+    """Опрос пользователя с ограничением параллельности и сроком выполнения"""
+    async with semaphore:
+        try:
+            await asyncio.wait_for(poll_user_tickets(bot, telegram_id, session_data), timeout=POLL_USER_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Опрос заявок пользователя {telegram_id} не уложился в {POLL_USER_TIMEOUT} с")
+        except Exception as e:
+            print(f"Ошибка опроса заявок пользователя {telegram_id}: {str(e)}")
+
+async def check_ticket_updates(bot: Bot, interval: float = POLL_INTERVAL):
+    """Периодически проверяет изменения заявок и отправляет уведомления.
+    
+    Если изменения приходят вебхуком GLPI, опрос остается сверочным и идет с большим interval.
+    Каждый пользователь опрашивается отдельной задачей: одновременно работает не больше
+    POLL_CONCURRENCY задач, а новая задача пользователя не запускается, пока не
+    завершилась предыдущая. Медленный пользователь не задерживает остальных.
+    """
+    semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+    poll_tasks: Dict[int, asyncio.Task] = {}
+    evicted_at = time.monotonic()
     while True:
         try:
-            # Для каждого авторизованного пользователя проверяем его заявки
+            await notify_stale_sessions(bot)
+            
+            if time.monotonic() - evicted_at >= SNAPSHOT_EVICT_INTERVAL:
+                evicted_at = time.monotonic()
+                evict_ticket_snapshots()
+            
+            # user_sessions.items() отдает снимок, поэтому вход и выход пользователей
+            # во время цикла безопасны
+            active_ids = set()
             for telegram_id, session_data in user_sessions.items():
-                session_token = session_data.get('session_token')
-                if not session_token:
+                # Каталог категорий обновляется в фоне с сессией любого пользователя
+                if not active_ids:
+                    schedule_refresh(glpi, session_data['session_token'])
+                active_ids.add(telegram_id)
+                task = poll_tasks.get(telegram_id)
+                if task is not None and not task.done():
                     continue
-                
-                tickets = get_user_tickets(session_data, telegram_id)
-                if not tickets:
-                    continue
-                
-                for ticket in tickets:
-                    ticket_id = ticket.get('id')
-                    current_comments = get_ticket_comments(session_token, ticket_id)
-                    
-                    current_data = {
-                        'id': ticket_id,
-                        'name': ticket.get('name'),
-                        'content': clean_html_content(ticket.get('content', '')),
-                        'status': ticket.get('status'),
-                        'urgency': ticket.get('urgency'),
-                        'impact': ticket.get('impact'),
-                        'type': ticket.get('type'),
-                        'time_to_resolve': ticket.get('time_to_resolve'),
-                        'comments': current_comments,
-                    }
-                    
-                    # Если заявка новая, сохраняем ее состояние
-                    if ticket_id not in last_ticket_states:
-                        last_ticket_states[ticket_id] = current_data
-                        continue
-                    
-                    # Получаем предыдущее состояние
-                    previous_data = last_ticket_states[ticket_id]
-                    
-                    # Проверяем изменения по всем отслеживаемым полям
-                    changes = detect_ticket_changes(previous_data, current_data)
-                    
-
-                     # Проверяем новые комментарии
-                    new_comments = get_new_comments(
-                        previous_data.get('comments', []),
-                        current_data.get('comments', [])
-                    )
-                    
-
-         # Получаем полные данные заявки
-                    ticket_details = get_ticket_details(session_token, ticket_id)
-                    if not ticket_details:
-                        continue
-                    
-                    # Ищем Telegram ID инициатора
-                    initiator_id = find_telegram_id_in_content(ticket_details.get('content', ''))
-                    if not initiator_id:
-                        continue
-                    
-                    # Если есть только новые комментарии - отправляем только уведомление о них
-                    if new_comments and not changes:
-                        await send_comment_notification(
-                            bot,
-                            ticket_id,
-                            current_data.get('name', 'Без названия'),
-                            new_comments,
-                            initiator_id,
-                            session_token  # Добавляем session_token для получения имен пользователей
-                        )
-                    # Если есть изменения (но нет новых комментариев) - отправляем уведомление об изменениях
-                    elif changes and not new_comments:
-                        await send_ticket_update_notification(
-                            bot, 
-                            ticket_id, 
-                            previous_data, 
-                            current_data, 
-                            changes, 
-                            initiator_id
-                        )
-                    # Если есть и то и другое - отправляем комбинированное уведомление
-                    elif changes and new_comments:
-                        await send_combined_notification(
-                            bot,
-                            ticket_id,
-                            current_data.get('name', 'Без названия'),
-                            changes,
-                            new_comments,
-                            initiator_id,
-                            session_token
-                        )
-                    
-                    # Обновляем последнее известное состояние
-                    last_ticket_states[ticket_id] = current_data
+                poll_tasks[telegram_id] = asyncio.create_task(
+                    poll_user_with_limits(bot, semaphore, telegram_id, session_data)
+                )
             
-            await asyncio.sleep(10)  # Пауза между проверками
+            # Забываем завершенные задачи пользователей, которые вышли
+            for telegram_id in list(poll_tasks):
+                if telegram_id not in active_ids and poll_tasks[telegram_id].done():
+                    del poll_tasks[telegram_id]
             
         except Exception as e:
             print(f"Ошибка в check_ticket_updates: {str(e)}")
-            await asyncio.sleep(10)
+        
+        await asyncio.sleep(interval)  # Пауза между проверками
 
 async def send_comment_notification(
     bot: Bot,
@@ -726,9 +1138,11 @@ async def send_comment_notification(
         "Последние комментарии:"
     ]
     
+    # Имена всех авторов получаем одним запросом
+    await prefetch_user_names(session_token, [c.get('users_id') for c in comments[-3:]])
     for comment in comments[-3:]:  # Показываем последние 3 комментария
         comment_text = clean_html_content(comment.get('content', ''))
-        comment_author = get_user_name(session_token, comment.get('users_id')) or 'Аноним'
+        comment_author = await get_user_name(session_token, comment.get('users_id')) or 'Аноним'
         comment_date = comment.get('date_creation', '')
         
         message_lines.append(
@@ -736,15 +1150,14 @@ async def send_comment_notification(
             f"{comment_text[:200]}{'...' if len(comment_text) > 200 else ''}"
         )
     
-    try:
-        await bot.send_message(
-            user_id,
-            "\n".join(message_lines),
-            disable_web_page_preview=True,
-            parse_mode=ParseMode.HTML  
-        )
-    except Exception as e:
-        print(f"Ошибка отправки уведомления о комментариях пользователю {user_id}: {str(e)}")
+    outbox.enqueue(
+        bot,
+        user_id,
+        "\n".join(message_lines),
+        description="уведомления о комментариях",
+        disable_web_page_preview=True,
+        parse_mode=ParseMode.HTML
+    )
 
 async def send_combined_notification(
     bot: Bot,
@@ -774,9 +1187,10 @@ async def send_combined_notification(
         "Новые комментарии:"
     ])
     
+    await prefetch_user_names(session_token, [c.get('users_id') for c in comments[-2:]])
     for comment in comments[-2:]:  # Показываем последние 2 комментария
         comment_text = clean_html_content(comment.get('content', ''))
-        comment_author = get_user_name(session_token, comment.get('users_id')) or 'Аноним'
+        comment_author = await get_user_name(session_token, comment.get('users_id')) or 'Аноним'
         comment_date = comment.get('date_creation', '')
         
         message_lines.append(
@@ -786,71 +1200,106 @@ async def send_combined_notification(
         
     message_lines.append(f"\n📅 Последнее изменение: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
     
-    try:
-        await bot.send_message(
-            user_id,
-            "\n".join(message_lines),
-            disable_web_page_preview=True,
-            parse_mode=ParseMode.HTML  
-        )
-    except Exception as e:
-        print(f"Ошибка отправки комбинированного уведомления пользователю {user_id}: {str(e)}")
+    outbox.enqueue(
+        bot,
+        user_id,
+        "\n".join(message_lines),
+        description="комбинированного уведомления",
+        disable_web_page_preview=True,
+        parse_mode=ParseMode.HTML
+    )
+
+def format_user_name(user_data: dict, user_id: int) -> str:
+    """Собирает отображаемое имя из данных пользователя GLPI"""
+    # Получаем все возможные варианты имени
+    firstname = user_data.get('firstname')
+    realname = user_data.get('realname')
+    name = user_data.get('name')
+    
+    # Формируем полное имя из firstname и realname, если они есть
+    if firstname is not None or realname is not None:
+        firstname = firstname.strip() if isinstance(firstname, str) else ''
+        realname = realname.strip() if isinstance(realname, str) else ''
+        full_name = f"{firstname} {realname}".strip()
+        if full_name:
+            return full_name
+    
+    # Если firstname и realname None или пустые, используем name
+    if name is not None:
+        return name.strip() if isinstance(name, str) else f"Пользователь {user_id}"
+    
+    # Если ничего не найдено
+    return f"Пользователь {user_id}"
 
-def get_user_name(session_token: str, user_id: int) -> Optional[str]:
+async def get_user_name(session_token: str, user_id: int) -> Optional[str]:
     if not user_id or not session_token:
         return None
     
-    url = f"{GLPI_URL}/User/{user_id}"
-    headers = {
-        "Content-Type": "application/json",
-        "App-Token": GLPI_API_KEY,
-        "Session-Token": session_token
-    }
+    cached = user_names_cache.get(user_id, MISSING)
+    if cached is not MISSING:
+        return cached if cached is not None else f"Пользователь {user_id}"
     
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code in (200, 206):
-            user_data = response.json()
-            
-            # Получаем все возможные варианты имени
-            firstname = user_data.get('firstname')
-            realname = user_data.get('realname')
-            name = user_data.get('name')
-            
-            # Формируем полное имя из firstname и realname, если они есть
-            if firstname is not None or realname is not None:
-                firstname = firstname.strip() if isinstance(firstname, str) else ''
-                realname = realname.strip() if isinstance(realname, str) else ''
-                full_name = f"{firstname} {realname}".strip()
-                if full_name:
-                    return full_name
-            
-            # Если firstname и realname None или пустые, используем name
-            if name is not None:
-                return name.strip() if isinstance(name, str) else f"Пользователь {user_id}"
-            
-            # Если ничего не найдено
-            return f"Пользователь {user_id}"
-            
-        else:
-            print(f"Ошибка получения пользователя {user_id}: {response.status_code} {response.text}")
-            return f"Пользователь {user_id}"
+        status, user_data = await glpi.get_item(session_token, 'User', user_id)
+        if status in (200, 206):
+            full_name = format_user_name(user_data, user_id)
+            user_names_cache.set(user_id, full_name)
+            return full_name
+        
+        if status == 404:
+            user_names_cache.set(user_id, None, ttl=USER_NAME_NEGATIVE_TTL)
+        print(f"Ошибка получения пользователя {user_id}: {status} {user_data}")
+        return f"Пользователь {user_id}"
     except Exception as e:
         print(f"Исключение при получении пользователя {user_id}: {e}")
         return f"Пользователь {user_id}"
+
+async def prefetch_user_names(session_token: str, user_ids: list):
+    """Загружает в кэш имена всех еще не известных пользователей одним запросом"""
+    missing_ids = sorted({
+        user_id for user_id in user_ids
+        if user_id and user_id not in user_names_cache
+    })
+    if not missing_ids or not session_token:
+        return
+    
+    try:
+        status, items = await glpi.get_multiple_items(session_token, [('User', user_id) for user_id in missing_ids])
+        if status not in (200, 206) or not isinstance(items, list):
+            print(f"Ошибка пакетного получения пользователей: {status} {items}")
+            return
+        
+        found_ids = set()
+        for user_data in items:
+            if isinstance(user_data, dict) and user_data.get('id'):
+                found_ids.add(user_data['id'])
+                user_names_cache.set(user_data['id'], format_user_name(user_data, user_data['id']))
+        
+        # Пользователи, которых нет в ответе, запоминаются как отсутствующие
+        for user_id in missing_ids:
+            if user_id not in found_ids:
+                user_names_cache.set(user_id, None, ttl=USER_NAME_NEGATIVE_TTL)
+    except Exception as e:
+        print(f"Исключение при пакетном получении пользователей: {e}")
     
     
-def detect_ticket_changes(previous: dict, current: dict) -> Dict[str, Tuple]:
+def detect_ticket_changes(previous: TicketSnapshot, current: TicketSnapshot) -> Dict[str, Tuple]:
     """Обнаруживает изменения между состояниями заявки"""
     changes = {}
     
     for field, (field_name, formatter) in TRACKED_FIELDS.items():
-       # Пропускаем комментарии, так как они обрабатываются отдельно
-        if field == 'comments':
-            continue
-            
-        prev_value = previous.get(field)
-        curr_value = current.get(field)
+        # Описание сравнивается по хэшу (изменение может быть дальше начала,
+        # которое показывается в уведомлении)
+        if field == 'content':
+            if previous.content_hash == current.content_hash:
+                continue
+            prev_value, curr_value = previous.content_preview, current.content_preview
+            if prev_value == curr_value:
+                # Начало описания то же - иначе "Было" и "Стало" в уведомлении совпадут
+                curr_value = f"{curr_value} (изменено после первых {CONTENT_PREVIEW_LENGTH} символов)"
+        else:
+            prev_value = getattr(previous, field)
+            curr_value = getattr(current, field)
         
         if prev_value != curr_value:
             changes[field] = (
@@ -864,15 +1313,14 @@ def detect_ticket_changes(previous: dict, current: dict) -> Dict[str, Tuple]:
 async def send_ticket_update_notification(
     bot: Bot, 
     ticket_id: int, 
-    previous_data: dict, 
-    current_data: dict, 
+    ticket_name: str, 
     changes: Dict[str, Tuple], 
     user_id: int
 ):
     """Отправляет уведомление об изменениях в заявке"""
     message_lines = [
         f"📢 Изменения в заявке #{ticket_id}",
-        f"📌 Тема: {current_data.get('name', 'Без названия')}",
+        f"📌 Тема: {ticket_name}",
         "",
         "Измененные параметры:"
     ]
@@ -887,29 +1335,9 @@ async def send_ticket_update_notification(
         f"📅 Последнее изменение: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
     ])
     
-    try:
-        await bot.send_message(
-            user_id,
-            "\n".join(message_lines),
-            disable_web_page_preview=True
-        )
-    except Exception as e:
-        print(f"Ошибка отправки уведомления пользователю {user_id}: {str(e)}")
-
-def get_ticket_details(session_token: str, ticket_id: int) -> Optional[dict]:
-    """Получает полные детали заявки"""
-    url = f"{GLPI_URL}/Ticket/{ticket_id}"
-    headers = {
-        "Content-Type": "application/json",
-        "App-Token": GLPI_API_KEY,
-        "Session-Token": session_token
-    }
-    
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-    except Exception as e:
-        print(f"Ошибка получения деталей заявки {ticket_id}: {str(e)}")
-    return None
-    
\ No newline at end of file
+    outbox.enqueue(
+        bot,
+        user_id,
+        "\n".join(message_lines),
+        disable_web_page_preview=True
+    )
@@ -0,0 +1,83 @@
+"""Сравнивает накладные расходы SQLiteStorage и MemoryStorage на апдейт диалога.
+
+Каждый апдейт повторяет то, что делает бот на шаге создания заявки:
+get_state (middleware FSM), update_data и set_state в обработчике.
+Запись на диск (flush) в боте идет в фоне, поэтому измеряется отдельно.
+
+Пример:
+    python tools/bench_fsm_storage.py --users 1000 --steps 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.fsm_storage import SQLiteStorage
+
+STEPS = ['NewTicketForm:TITLE', 'NewTicketForm:DESCRIPTION', 'NewTicketForm:URGENCY', 'NewTicketForm:TYPE', None]
+
+
+async def run_dialogues(storage, users: int, steps: int) -> float:
+    """Прогоняет диалоги users пользователей; возвращает среднее время апдейта в микросекундах"""
+    contexts = [
+        FSMContext(storage, StorageKey(bot_id=1, chat_id=user_id, user_id=user_id))
+        for user_id in range(1, users + 1)
+    ]
+    updates = 0
+    started = time.perf_counter()
+    for step in range(steps):
+        state = STEPS[step % len(STEPS)]
+        for context in contexts:
+            await context.get_state()
+            await context.update_data({f'field{step}': 'x' * 50})
+            await context.set_state(state)
+            updates += 1
+    return (time.perf_counter() - started) / updates * 1e6
+
+
+async def main(users: int, steps: int):
+    memory_us = await run_dialogues(MemoryStorage(), users, steps)
+    print(f"MemoryStorage: {memory_us:.1f} мкс на апдейт")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'fsm.db')
+        storage = SQLiteStorage(path)
+        storage.load()
+        sqlite_us = await run_dialogues(storage, users, steps)
+        print(f"SQLiteStorage: {sqlite_us:.1f} мкс на апдейт, x{sqlite_us / memory_us:.1f} к MemoryStorage")
+        started = time.perf_counter()
+        written = await storage.flush()
+        flush_ms = (time.perf_counter() - started) * 1000
+        await storage.close()
+        print(f"flush: {written} записей за {flush_ms:.1f} мс ({flush_ms * 1000 / max(written, 1):.1f} мкс на запись)")
+
+        # После перезапуска незаконченные диалоги загружаются одним запросом
+        storage = SQLiteStorage(path)
+        started = time.perf_counter()
+        storage.load()
+        load_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        restored = 0
+        for user_id in range(1, users + 1):
+            if await storage.get_state(StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)):
+                restored += 1
+        read_us = (time.perf_counter() - started) / users * 1e6
+        await storage.close()
+        print(f"После перезапуска: загрузка {load_ms:.1f} мс, восстановлено диалогов {restored} из {users}, "
+              f"чтение {read_us:.1f} мкс")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=4, help='шагов диалога на пользователя')
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.steps))
@@ -0,0 +1,61 @@
+"""Отправляет боту подписанные события GLPI так же, как их отправляет вебхук GLPI 10 - для локальной проверки.
+
+Пример:
+    python tools/fake_glpi_webhook.py --secret <glpi_webhook_secret> --ticket-id 42
+    python tools/fake_glpi_webhook.py --secret <glpi_webhook_secret> --ticket-id 42 --followup 1001
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.glpi_signature import SIGNATURE_HEADER, TIMESTAMP_HEADER, sign_payload
+
+
+def make_payload(ticket_id: int, event: str, followup_id: int = 0) -> dict:
+    """Событие по заявке или, если задан followup_id, по ее комментарию"""
+    if followup_id:
+        item = {'id': followup_id, 'itemtype': 'Ticket', 'items_id': ticket_id, 'content': 'Тестовый комментарий'}
+        return {'event': event, 'itemtype': 'ITILFollowup', 'item': item}
+    return {'event': event, 'itemtype': 'Ticket', 'item': {'id': ticket_id}}
+
+
+async def send(url: str, secret: str, payload: dict, count: int, bad_signature: bool):
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    async with aiohttp.ClientSession() as session:
+        for _ in range(count):
+            timestamp = str(int(time.time()))
+            signature = sign_payload(body, timestamp, 'wrong-secret' if bad_signature else secret)
+            headers = {
+                'Content-Type': 'application/json',
+                SIGNATURE_HEADER: signature,
+                TIMESTAMP_HEADER: timestamp,
+            }
+            started = time.monotonic()
+            async with session.post(url, data=body, headers=headers) as response:
+                await response.read()
+                print(f"{response.status} за {(time.monotonic() - started) * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8080/glpi/webhook')
+    parser.add_argument('--secret', required=True, help='glpi_webhook_secret бота')
+    parser.add_argument('--ticket-id', type=int, required=True)
+    parser.add_argument('--event', default='update', help='new, update, delete ...')
+    parser.add_argument('--followup', type=int, default=0, help='ID комментария - событие по комментарию заявки')
+    parser.add_argument('--count', type=int, default=1, help='сколько раз повторить событие')
+    parser.add_argument('--bad-signature', action='store_true', help='подписать неверным секретом (ожидается 401)')
+    args = parser.parse_args()
+    payload = make_payload(args.ticket_id, args.event, args.followup)
+    asyncio.run(send(args.url, args.secret, payload, args.count, args.bad_signature))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Отправляет в вебхук бота поддельные апдейты Telegram - для локальной проверки режима webhook.
+
+Пример:
+    python tools/fake_telegram_update.py --url http://127.0.0.1:8080/telegram/webhook \\
+        --secret <webhook_secret> --text "/cancel" --count 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from collections import Counter
+
+import aiohttp
+
+update_ids = itertools.count(int(time.time()))
+
+
+def make_update(user_id: int, text: str) -> dict:
+    """Апдейт с личным сообщением пользователя user_id"""
+    update_id = next(update_ids)
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'Test'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Test'},
+            'from': user,
+            'text': text,
+        },
+    }
+
+
+async def post_updates(url: str, secret: str, text: str, count: int, concurrency: int, users: int, first_user: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = Counter()
+    latencies = []
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def post(number: int):
+            update = make_update(first_user + number % users, text)
+            async with semaphore:
+                started = time.monotonic()
+                try:
+                    async with session.post(url, json=update) as response:
+                        await response.read()
+                        statuses[response.status] += 1
+                except aiohttp.ClientError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.monotonic() - started)
+
+        started = time.monotonic()
+        await asyncio.gather(*(post(number) for number in range(count)))
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+    print(f"Отправлено апдейтов: {count} за {elapsed:.2f} с ({count / elapsed:.0f}/с)")
+    print(f"Ответы: {dict(statuses)}")
+    if latencies:
+        print(
+            f"Задержка ответа: медиана {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8080/telegram/webhook')
+    parser.add_argument('--secret', default='', help='webhook_secret бота; без него ожидается ответ 401')
+    parser.add_argument('--text', default='/cancel', help='текст сообщения в апдейте')
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=10, help='одновременных запросов')
+    parser.add_argument('--users', type=int, default=1, help='сколько разных пользователей отправляют сообщения')
+    parser.add_argument('--user-id', type=int, default=100000, help='Telegram ID первого пользователя')
+    args = parser.parse_args()
+    asyncio.run(post_updates(args.url, args.secret, args.text, args.count, args.concurrency, args.users, args.user_id))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from utils.embedding_cache import EmbeddingCache, normalize_text
+from utils.inference import EmbeddingService
+from utils.vector_store import VectorStore
+
+# Модель для эмбеддингов загружается лениво (см. get_model)
+MODEL_NAME = os.getenv('embedding_model', 'paraphrase-multilingual-MiniLM-L12-v2')
+model = None
+_model_lock = threading.Lock()
+
+# Каталог для кэша эмбеддингов категорий на диске
+DATA_DIR = os.getenv('data_dir', 'data')
+
+# Общий кэш эмбеддингов текстов; на диск сохраняется, только если задан embedding_cache_path
+embedding_cache = EmbeddingCache(
+    MODEL_NAME,
+    maxsize=int(os.getenv('embedding_cache_size', 10000)),
+    path=os.getenv('embedding_cache_path'),
+)
+
+# Ниже этого сходства заявка относится к категории "Другое"
+CATEGORY_THRESHOLD = 0.3
+# Размер пакета для model.encode при пакетной категоризации
+ENCODE_BATCH_SIZE = 64
+
+# Векторная база данных категорий
+CATEGORIES = {
+    "Авторизация": {
+        "description": "Проблемы с входом в систему, сброс пароля, блокировка учетной записи",
+    },
+    "Вопросы HR": {
+        "description": "Кадровые вопросы, отпуска, больничные, оформление документов",
+    },
+    "Вопросы о времени": {
+        "description": "График работы, табель учета времени, опоздания, перенос встреч",
+    },
+    "Технические проблемы": {
+        "description": "Неисправности оборудования, проблемы с ПО, доступ к ресурсам",
+    }
+}
+
+# Формат хранения векторов категорий: float32, float16 или int8 (см. utils.vector_store)
+CATEGORY_VECTORS_DTYPE = os.getenv('category_vectors_dtype', 'float32')
+
+# Названия категорий; ID в category_store - индекс в этом списке
+CATEGORY_NAMES: List[str] = []
+# Эмбеддинги категорий одной нормированной матрицей
+category_store: Optional[VectorStore] = None
+
+
+def get_model():
+    """Загружает модель при первом обращении (потокобезопасно)"""
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(MODEL_NAME)
+    return model
+
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    """Единая точка вызова model.encode: модель кодирует только тексты, которых нет в кэше"""
+    normalized = [normalize_text(text) for text in texts]
+    embeddings: List[Optional[np.ndarray]] = [embedding_cache.get(text) for text in normalized]
+
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        encoded = get_model().encode(
+            [normalized[i] for i in missing], batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True
+        )
+        for i, embedding in zip(missing, encoded):
+            embedding_cache.put(normalized[i], embedding)
+            embeddings[i] = embedding
+    return np.vstack(embeddings)
+
+
+def category_cache_prefix(texts: List[str]) -> str:
+    """Путь к кэшу эмбеддингов: ключ - имя модели, формат векторов и хэш текстов категорий"""
+    digest = hashlib.sha256()
+    digest.update(MODEL_NAME.encode())
+    for text in texts:
+        digest.update(b'\0' + text.encode())
+    model_slug = MODEL_NAME.replace('/', '_')
+    return os.path.join(
+        DATA_DIR, f'categories-{model_slug}-{CATEGORY_VECTORS_DTYPE}-{digest.hexdigest()[:16]}'
+    )
+
+
+def load_or_encode(texts: List[str]) -> VectorStore:
+    """Открывает эмбеддинги с диска (memory-mapped), а если кэша нет - считает и сохраняет"""
+    prefix = category_cache_prefix(texts)
+    try:
+        store = VectorStore.load(prefix)
+        if store is not None and len(store) == len(texts):
+            return store
+    except (OSError, ValueError) as e:
+        print(f"Не удалось прочитать кэш эмбеддингов {prefix}: {str(e)}")
+
+    store = VectorStore.from_embeddings(range(len(texts)), encode_texts(texts), CATEGORY_VECTORS_DTYPE)
+    try:
+        store.save(prefix)
+    except OSError as e:
+        print(f"Не удалось сохранить кэш эмбеддингов {prefix}: {str(e)}")
+    return store
+
+
+_categories_lock = threading.Lock()
+
+# Инициализация эмбеддингов для категорий
+def initialize_category_embeddings():
+    global CATEGORY_NAMES, category_store
+
+    with _categories_lock:
+        if category_store is not None:
+            return
+
+        # Эмбеддинг строится по названию категории и ее описанию
+        names = list(CATEGORIES)
+        texts = [f"{name}: {CATEGORIES[name]['description']}" for name in names]
+        category_store = load_or_encode(texts)
+        CATEGORY_NAMES = names
+
+
+def warm_up():
+    """Загружает эмбеддинги категорий и модель; запускается в фоне после старта бота"""
+    try:
+        embedding_cache.load()
+        initialize_category_embeddings()
+        get_model()
+    except Exception as e:
+        print(f"Ошибка прогрева модели эмбеддингов: {str(e)}")
+
+
+def rank_categories(embeddings: np.ndarray, top_k: int = 3) -> List[List[Tuple[str, float]]]:
+    """Для каждой строки embeddings возвращает top_k категорий с косинусным сходством, по убыванию"""
+    initialize_category_embeddings()
+    if category_store is None or not CATEGORY_NAMES:
+        return [[] for _ in range(len(embeddings))]
+
+    # Сходство всех текстов со всеми категориями - одно матричное произведение
+    scores = category_store.similarities(embeddings)
+    top_k = min(top_k, scores.shape[1])
+    top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+
+    results = []
+    for row, indices in zip(scores, top):
+        indices = indices[np.argsort(-row[indices])]
+        results.append([(CATEGORY_NAMES[category_store.ids[i]], float(row[i])) for i in indices])
+    return results
+
+
+def find_best_categories(texts: List[str], top_k: int = 3) -> List[List[Tuple[str, float]]]:
+    """
+    Пакетно подбирает категории для списка текстов.
+    Возвращает для каждого текста top_k пар (категория, score) по убыванию сходства.
+    """
+    if not texts:
+        return []
+    return rank_categories(np.atleast_2d(encode_texts(texts)), top_k)
+
+
+def pick_category(ranked: List[Tuple[str, float]]) -> Tuple[str, float]:
+    """Выбирает лучшую категорию; если сходство слишком низкое, возвращает "Другое\""""
+    if not ranked:
+        return "Другое", 0.0
+    best_category, best_score = ranked[0]
+    if best_score < CATEGORY_THRESHOLD:
+        return "Другое", max(best_score, 0.0)
+    return best_category, best_score
+
+
+def find_best_category(title: str, description: str) -> Tuple[str, float]:
+    """
+    Находит наиболее подходящую категорию для заявки на основе названия и описания.
+    Возвращает название категории и score сходства (0-1).
+    """
+    if not title and not description:
+        return "Другое", 0.0
+
+    ranked = find_best_categories([f"{title}: {description}"], top_k=1)[0]
+    return pick_category(ranked)
+
+
+# Сервис эмбеддингов: инференс в отдельном потоке, параллельные запросы объединяются в микропакеты
+embedding_service = EmbeddingService(
+    encode_texts,
+    cache=embedding_cache,
+    max_batch_size=int(os.getenv('embed_max_batch_size', 32)),
+    batch_window=float(os.getenv('embed_batch_window', 0.01)),
+    max_queue_size=int(os.getenv('embed_max_queue_size', 256)),
+)
+
+
+async def ensure_categories_loaded():
+    """Инициализирует эмбеддинги категорий в пуле потоков, не блокируя цикл событий"""
+    if category_store is None:
+        await asyncio.get_running_loop().run_in_executor(None, initialize_category_embeddings)
+
+
+async def categorize(title: str, description: str) -> Tuple[str, float]:
+    """Асинхронный вариант find_best_category: инференс не блокирует цикл событий"""
+    if not title and not description:
+        return "Другое", 0.0
+
+    embedding = await embedding_service.encode(f"{title}: {description}")
+    await ensure_categories_loaded()
+    return pick_category(rank_categories(np.atleast_2d(embedding), top_k=1)[0])
+
+
+async def categorize_many(texts: List[str], top_k: int = 3) -> List[List[Tuple[str, float]]]:
+    """Асинхронный вариант find_best_categories"""
+    if not texts:
+        return []
+    embeddings = await embedding_service.encode_many(texts)
+    await ensure_categories_loaded()
+    return rank_categories(embeddings, top_k)
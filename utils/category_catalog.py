@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.categorizer import (
+    CATEGORY_THRESHOLD, CATEGORY_VECTORS_DTYPE, DATA_DIR, ENCODE_BATCH_SIZE, MODEL_NAME,
+    categorize, embedding_service,
+)
+from utils.glpi_client import GLPIClient
+from utils.vector_store import VectorStore
+
+# Категория, которая отправляется в GLPI, если подобрать категорию из каталога не удалось (0 - без категории)
+DEFAULT_CATEGORY_ID = int(os.getenv('default_itilcategory_id', 0))
+# Как часто проверять изменения каталога и как часто перечитывать его полностью (чтобы заметить удаления)
+CATALOG_REFRESH_INTERVAL = float(os.getenv('category_catalog_refresh_interval', 600))
+CATALOG_FULL_REFRESH_INTERVAL = float(os.getenv('category_catalog_full_refresh_interval', 86400))
+CATALOG_PAGE_SIZE = int(os.getenv('category_catalog_page_size', 500))
+
+# Типы заявок GLPI и поля категории, которые разрешают их
+TICKET_TYPE_FLAGS = {
+    1: 'is_incident',
+    2: 'is_request',
+}
+
+
+def parse_category(item: dict) -> dict:
+    """Оставляет от ITILCategory только поля, которые нужны боту"""
+    return {
+        'name': item.get('completename') or item.get('name') or '',
+        'comment': item.get('comment') or '',
+        'date_mod': item.get('date_mod') or '',
+        'is_helpdeskvisible': bool(item.get('is_helpdeskvisible', 1)),
+        'is_incident': bool(item.get('is_incident', 1)),
+        'is_request': bool(item.get('is_request', 1)),
+    }
+
+
+def category_text(category: dict) -> str:
+    """Текст для эмбеддинга: полное имя категории (с родителями) и ее комментарий"""
+    if category['comment']:
+        return f"{category['name']}: {category['comment']}"
+    return category['name']
+
+
+class CategoryCatalog:
+    """Каталог категорий заявок (ITILCategory) из GLPI с эмбеддингами.
+
+    Каталог хранится в памяти и на диске; при обновлении из GLPI запрашиваются
+    только категории с date_mod не старше отметки, а эмбеддинги пересчитываются
+    только у категорий, текст которых изменился. Подбор категории - одно
+    матричное произведение и не обращается к GLPI.
+    """
+
+    def __init__(self, path_prefix: str, dtype: str = 'float32'):
+        self.path_prefix = path_prefix
+        self.meta_path = f'{path_prefix}.catalog.json'
+        self.dtype = dtype
+        self.categories: Dict[int, dict] = {}
+        self.store: Optional[VectorStore] = None
+        # Допустимые категории по строкам store: None - видимые в самообслуживании,
+        # тип заявки - видимые и разрешенные для этого типа
+        self.masks: Dict[Optional[int], np.ndarray] = {}
+        self.watermark = ''
+        self.refreshed_at = 0.0
+        self.full_refreshed_at = 0.0
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def load(self):
+        """Загружает каталог, сохраненный при прошлом запуске"""
+        if not os.path.exists(self.meta_path):
+            return
+        try:
+            with open(self.meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('model') != MODEL_NAME or meta.get('dtype') != self.dtype:
+                return
+            categories = {int(category_id): category for category_id, category in meta['categories'].items()}
+            store = VectorStore.load(self.path_prefix) if categories else None
+            if store is not None and set(store.ids.tolist()) != set(categories):
+                raise ValueError('векторы не соответствуют категориям')
+            self.categories, self.store, self.watermark = categories, store, meta.get('watermark', '')
+            self.build_masks()
+            print(f"Загружен каталог категорий: {len(self.categories)} категорий")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Не удалось загрузить каталог категорий: {str(e)}")
+
+    def save(self):
+        """Сохраняет каталог, если он изменился"""
+        if not self.dirty:
+            return
+        store, categories = self.store, dict(self.categories)
+        self.dirty = False
+        try:
+            if store is not None:
+                store.save(self.path_prefix)
+            tmp_path = f'{self.meta_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'model': MODEL_NAME,
+                    'dtype': self.dtype,
+                    'watermark': self.watermark,
+                    'categories': categories,
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, self.meta_path)
+        except OSError as e:
+            self.dirty = True
+            print(f"Не удалось сохранить каталог категорий: {str(e)}")
+
+    async def fetch(self, glpi: GLPIClient, session_token: str, full: bool) -> Dict[int, dict]:
+        """Запрашивает категории у GLPI: все или только измененные после отметки"""
+        fetched = {}
+        params = {'sort': 'id', 'order': 'ASC'} if full else {'sort': 'date_mod', 'order': 'DESC'}
+        async for page in glpi.iter_items(session_token, 'ITILCategory', params=params, page_size=CATALOG_PAGE_SIZE):
+            reached_watermark = False
+            for item in page:
+                category = parse_category(item)
+                # date_mod хранится с точностью до секунды: категории из той же секунды перечитываются
+                if not full and self.watermark and category['date_mod'] < self.watermark:
+                    reached_watermark = True
+                    break
+                fetched[int(item['id'])] = category
+            if reached_watermark:
+                break
+        return fetched
+
+    async def encode(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Кодирует тексты небольшими пачками, чтобы запросы при создании заявок не ждали весь каталог"""
+        if not texts:
+            return None
+        chunks = []
+        for start in range(0, len(texts), ENCODE_BATCH_SIZE):
+            chunks.append(await embedding_service.encode_many(texts[start:start + ENCODE_BATCH_SIZE]))
+        return np.vstack(chunks)
+
+    async def refresh(self, glpi: GLPIClient, session_token: str, full: bool = False):
+        """Обновляет каталог из GLPI и пересчитывает эмбеддинги измененных категорий"""
+        full = full or not self.categories
+        fetched = await self.fetch(glpi, session_token, full)
+        removed = set(self.categories) - set(fetched) if full else set()
+        changed = {
+            category_id: category for category_id, category in fetched.items()
+            if self.categories.get(category_id) != category
+        }
+        reembed = [
+            category_id for category_id, category in changed.items()
+            if category_id not in self.categories or category_text(self.categories[category_id]) != category_text(category)
+        ]
+
+        embeddings = await self.encode([category_text(changed[category_id]) for category_id in reembed])
+
+        # Дальше нет await: подбор категорий не увидит каталог в промежуточном состоянии
+        if removed and self.store is not None:
+            self.store.remove(removed)
+        if reembed:
+            if self.store is None:
+                self.store = VectorStore.from_embeddings(reembed, embeddings, self.dtype)
+            else:
+                self.store.upsert(reembed, embeddings)
+        for category_id in removed:
+            del self.categories[category_id]
+        self.categories.update(changed)
+        if changed or removed:
+            self.build_masks()
+        if fetched:
+            self.watermark = max(self.watermark, max(category['date_mod'] for category in fetched.values()))
+
+        self.refreshed_at = time.monotonic()
+        if full:
+            self.full_refreshed_at = self.refreshed_at
+        if changed or removed:
+            self.dirty = True
+            print(f"Каталог категорий обновлен: изменено {len(changed)}, удалено {len(removed)}, "
+                  f"пересчитано эмбеддингов {len(reembed)}")
+
+    def build_masks(self):
+        """Пересчитывает маски допустимых категорий после изменения каталога"""
+        store = self.store
+        if store is None:
+            self.masks = {}
+            return
+        categories = [self.categories.get(category_id) for category_id in store.ids.tolist()]
+        visible = np.array([bool(category and category['is_helpdeskvisible']) for category in categories], dtype=bool)
+        masks = {None: visible}
+        for ticket_type, type_flag in TICKET_TYPE_FLAGS.items():
+            masks[ticket_type] = visible & np.array(
+                [bool(category and category[type_flag]) for category in categories], dtype=bool
+            )
+        self.masks = masks
+
+    def match(self, embedding: np.ndarray, ticket_type: Optional[int] = None) -> Optional[Tuple[int, str, float]]:
+        """Лучшая категория для заявки: (ID, полное имя, сходство) или None, если каталог пуст.
+
+        Учитываются только категории, видимые в интерфейсе самообслуживания
+        и разрешенные для типа заявки.
+        """
+        store = self.store
+        if store is None or len(store) == 0:
+            return None
+        scores = store.similarities(embedding)[0]
+
+        allowed = self.masks.get(ticket_type if ticket_type in TICKET_TYPE_FLAGS else None)
+        if allowed is None or len(allowed) != len(scores):
+            # Маски всегда строятся вместе с изменением store; сюда попадать не должны
+            self.build_masks()
+            allowed = self.masks[ticket_type if ticket_type in TICKET_TYPE_FLAGS else None]
+        if not allowed.any():
+            return None
+        scores = np.where(allowed, scores, -np.inf)
+        best = int(np.argmax(scores))
+        category_id = int(store.ids[best])
+        return category_id, self.categories[category_id]['name'], float(scores[best])
+
+
+category_catalog = CategoryCatalog(
+    os.path.join(DATA_DIR, f"itilcategories-{MODEL_NAME.replace('/', '_')}-{CATEGORY_VECTORS_DTYPE}"),
+    dtype=CATEGORY_VECTORS_DTYPE,
+)
+
+_refresh_task: Optional[asyncio.Task] = None
+
+
+async def _refresh(glpi: GLPIClient, session_token: str):
+    full = time.monotonic() - category_catalog.full_refreshed_at > CATALOG_FULL_REFRESH_INTERVAL
+    try:
+        await category_catalog.refresh(glpi, session_token, full=full)
+        await asyncio.get_running_loop().run_in_executor(None, category_catalog.save)
+    except Exception as e:
+        # Повтор - не раньше следующего интервала
+        category_catalog.refreshed_at = time.monotonic()
+        print(f"Ошибка обновления каталога категорий: {str(e)}")
+
+
+def schedule_refresh(glpi: GLPIClient, session_token: str, force: bool = False):
+    """Запускает обновление каталога в фоне, если подошел срок и обновление еще не идет"""
+    global _refresh_task
+    if _refresh_task is not None and not _refresh_task.done():
+        return
+    if not force and time.monotonic() - category_catalog.refreshed_at < CATALOG_REFRESH_INTERVAL:
+        return
+    _refresh_task = asyncio.create_task(_refresh(glpi, session_token))
+
+
+async def categorize_ticket(title: str, description: str, ticket_type: Optional[int] = None) -> Tuple[int, str, float]:
+    """Подбирает категорию GLPI для заявки: (ID категории, название, сходство).
+
+    Пока каталог не загружен, название берется из встроенного списка категорий,
+    а ID - DEFAULT_CATEGORY_ID.
+    """
+    if not category_catalog.categories:
+        category, score = await categorize(title, description)
+        return DEFAULT_CATEGORY_ID, category, score
+    if not title and not description:
+        return DEFAULT_CATEGORY_ID, "Другое", 0.0
+
+    embedding = await embedding_service.encode(f"{title}: {description}")
+    matched = category_catalog.match(embedding, ticket_type)
+    if matched is None or matched[2] < CATEGORY_THRESHOLD:
+        return DEFAULT_CATEGORY_ID, "Другое", max(matched[2], 0.0) if matched else 0.0
+    return matched
@@ -0,0 +1,104 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+
+
+class DigestEntry:
+    """Накопленные за окно изменения одной заявки для одного пользователя"""
+
+    __slots__ = ('bot', 'ticket_name', 'changes', 'comments', 'session_token')
+
+    def __init__(self, bot: Bot, ticket_name: str, session_token: str):
+        self.bot = bot
+        self.ticket_name = ticket_name
+        self.changes: Dict[str, Tuple[str, str, str]] = {}
+        self.comments: List[dict] = []
+        self.session_token = session_token
+
+
+def merge_changes(merged: Dict[str, Tuple[str, str, str]], changes: Dict[str, Tuple[str, str, str]]):
+    """Объединяет результаты detect_ticket_changes: "было" - первое, "стало" - последнее"""
+    for field, (field_name, prev_val, curr_val) in changes.items():
+        if field in merged:
+            prev_val = merged[field][1]
+        if prev_val == curr_val:
+            # Поле вернулось к исходному значению - сообщать не о чем
+            merged.pop(field, None)
+        else:
+            merged[field] = (field_name, prev_val, curr_val)
+
+
+class NotificationDigest:
+    """Сводка уведомлений по окну.
+
+    Первое событие по паре (пользователь, заявка) открывает окно на window
+    секунд; все изменения и комментарии, пришедшие за это время, отправляются
+    по его окончании одним сообщением через send_fn.
+    """
+
+    def __init__(
+        self,
+        send_fn: Callable[[Bot, int, int, str, dict, list, str], Awaitable[None]],
+        window: float = 60,
+    ):
+        self.send_fn = send_fn
+        self.window = window
+        self.received = 0
+        self.flushed = 0
+        self._entries: Dict[Tuple[int, int], DigestEntry] = {}
+        self._timers: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def add(
+        self,
+        bot: Bot,
+        user_id: int,
+        ticket_id: int,
+        ticket_name: str,
+        changes: Dict[str, Tuple[str, str, str]],
+        comments: list,
+        session_token: str,
+    ):
+        key = (user_id, ticket_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = DigestEntry(bot, ticket_name, session_token)
+            self._timers[key] = asyncio.get_running_loop().call_later(
+                self.window, lambda: asyncio.create_task(self.flush(key))
+            )
+        entry.ticket_name = ticket_name
+        entry.session_token = session_token
+        merge_changes(entry.changes, changes)
+        known = {comment.get('id') for comment in entry.comments}
+        entry.comments.extend(comment for comment in comments if comment.get('id') not in known)
+        self.received += 1
+
+    async def flush(self, key: Tuple[int, int]):
+        entry = self._entries.pop(key, None)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if entry is None or not (entry.changes or entry.comments):
+            return
+        user_id, ticket_id = key
+        self.flushed += 1
+        try:
+            await self.send_fn(
+                entry.bot, user_id, ticket_id, entry.ticket_name, entry.changes, entry.comments, entry.session_token
+            )
+        except Exception as e:
+            print(f"Ошибка отправки сводки по заявке {ticket_id} пользователю {user_id}: {str(e)}")
+
+    async def flush_all(self, user_id: Optional[int] = None):
+        """Отправляет накопленное сразу: всем или одному пользователю"""
+        keys = [key for key in self._entries if user_id is None or key[0] == user_id]
+        for key in keys:
+            await self.flush(key)
+
+    def stats(self) -> dict:
+        """Сколько событий пришло и сколько сообщений ушло вместо них"""
+        return {'events': self.received, 'messages': self.flushed, 'pending': self.pending}
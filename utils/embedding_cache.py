@@ -0,0 +1,97 @@
+import hashlib
+import os
+import threading
+import unicodedata
+from typing import Optional
+
+import numpy as np
+
+from utils.cache import MISSING, TTLCache
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста перед кодированием: Unicode NFC и схлопывание пробелов"""
+    return ' '.join(unicodedata.normalize('NFC', text or '').split())
+
+
+class EmbeddingCache:
+    """LRU-кэш эмбеддингов.
+
+    Ключ - хэш идентификатора модели и нормализованного текста, поэтому после
+    смены модели старые векторы не используются. Кэш можно сохранять на диск
+    (.npz) и загружать при следующем запуске.
+    """
+
+    def __init__(self, model_id: str, maxsize: int = 10000, path: Optional[str] = None):
+        self.model_id = model_id
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._cache = TTLCache(maxsize=maxsize)
+        # Кэш используется и из цикла событий, и из потоков инференса
+        self._lock = threading.Lock()
+
+    def key(self, normalized_text: str) -> bytes:
+        return hashlib.sha1(f'{self.model_id}\0{normalized_text}'.encode()).digest()
+
+    def get(self, normalized_text: str, count_miss: bool = True) -> Optional[np.ndarray]:
+        """Эмбеддинг из кэша или None. count_miss=False - промах не учитывается в статистике
+        (его учтет следующая проверка того же текста перед кодированием)"""
+        with self._lock:
+            embedding = self._cache.get(self.key(normalized_text), MISSING)
+            if embedding is MISSING:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self.hits += 1
+            return embedding
+
+    def put(self, normalized_text: str, embedding: np.ndarray):
+        with self._lock:
+            self._cache.set(self.key(normalized_text), np.asarray(embedding, dtype=np.float32))
+            self.dirty = True
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                if str(data['model_id']) != self.model_id:
+                    return
+                with self._lock:
+                    for key, embedding in zip(data['keys'], data['embeddings']):
+                        self._cache.set(key.tobytes(), embedding)
+            print(f"Загружен кэш эмбеддингов: {len(self._cache)} записей")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Не удалось загрузить кэш эмбеддингов {self.path}: {str(e)}")
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        with self._lock:
+            items = self._cache.items()
+            self.dirty = False
+        if not items:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f'{self.path}.tmp.npz'
+            np.savez(
+                tmp_path,
+                model_id=np.array(self.model_id),
+                keys=np.frombuffer(b''.join(key for key, _ in items), dtype=np.uint8).reshape(len(items), -1),
+                embeddings=np.vstack([value for _, value in items]),
+            )
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Не удалось сохранить кэш эмбеддингов {self.path}: {str(e)}")
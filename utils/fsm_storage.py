@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fsm_states_updated_at ON fsm_states (updated_at);
+'''
+
+
+def dump_key(key: StorageKey) -> str:
+    return json.dumps([
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny,
+    ])
+
+
+def load_key(value: str) -> StorageKey:
+    return StorageKey(*json.loads(value))
+
+
+class FSMRecord:
+    __slots__ = ('state', 'data', 'updated_at')
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None, updated_at: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний диалогов (FSM) в SQLite: незаконченные диалоги переживают перезапуск.
+
+    Чтения и записи идут в память: незаконченные диалоги загружаются при старте
+    (load; без нее запись догружается из базы при первом обращении), а
+    измененные записи сохраняются пачкой одной транзакцией (flush).
+    Состояния, не менявшиеся дольше ttl секунд, считаются брошенными: при обращении
+    они сбрасываются сразу, а из памяти и базы удаляются периодически (expire).
+    """
+
+    def __init__(self, path: str, ttl: float = 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        # В памяти записи хранятся по самому StorageKey, в строку он переводится только для базы
+        self._records: Dict[StorageKey, FSMRecord] = {}
+        self._dirty: Set[StorageKey] = set()
+        # После load в памяти все живые записи, и промах не требует чтения базы
+        self._loaded = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def load(self) -> int:
+        """Загружает незаконченные диалоги; возвращает их число"""
+        with self._db_lock:
+            rows = self._connect().execute(
+                'SELECT key, state, data, updated_at FROM fsm_states WHERE updated_at >= ?',
+                (time.time() - self.ttl,),
+            ).fetchall()
+        for key, state, data, updated_at in rows:
+            self._records.setdefault(load_key(key), FSMRecord(state, json.loads(data), updated_at))
+        self._loaded = True
+        return len(rows)
+
+    def _load(self, key: StorageKey) -> FSMRecord:
+        with self._db_lock:
+            row = self._connect().execute(
+                'SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (dump_key(key),)
+            ).fetchone()
+        if row is None or row[2] < time.time() - self.ttl:
+            return FSMRecord()
+        return FSMRecord(row[0], json.loads(row[1]), row[2])
+
+    async def _record(self, key: StorageKey) -> FSMRecord:
+        record = self._records.get(key)
+        if record is None and self._loaded:
+            record = self._records[key] = FSMRecord()
+        elif record is None:
+            loaded = await asyncio.get_running_loop().run_in_executor(None, self._load, key)
+            # Пока шел запрос, запись могла создать параллельная обработка апдейта
+            record = self._records.setdefault(key, loaded)
+        elif not record.empty and record.updated_at < time.time() - self.ttl:
+            # Брошенный диалог не продолжаем, даже если expire еще не удалил его
+            record = self._records[key] = FSMRecord()
+            self._dirty.add(key)
+        return record
+
+    def _touch(self, key: StorageKey, record: FSMRecord):
+        record.updated_at = time.time()
+        self._dirty.add(key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise ValueError(f"Data must be a dict, not {type(data).__name__}")
+        record = await self._record(key)
+        record.data = data.copy()
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._record(key)
+        return record.data.copy()
+
+    def _collect(self) -> Tuple[List[tuple], List[StorageKey]]:
+        """Снимок измененных записей; пустые (диалог завершен) удаляются из базы.
+        В памяти они остаются до expire, чтобы не перечитать из базы еще не удаленную запись"""
+        dirty, self._dirty = self._dirty, set()
+        rows, deletes = [], []
+        for key in dirty:
+            record = self._records.get(key)
+            if record is None or record.empty:
+                deletes.append(key)
+            else:
+                rows.append((key, record.state, json.dumps(record.data, ensure_ascii=False), record.updated_at))
+        return rows, deletes
+
+    def _write(self, rows: List[tuple], deletes: List[StorageKey]):
+        with self._db_lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany('DELETE FROM fsm_states WHERE key = ?', [(dump_key(key),) for key in deletes])
+                conn.executemany('INSERT OR REPLACE INTO fsm_states VALUES (?, ?, ?, ?)', [
+                    (dump_key(key), state, data, updated_at) for key, state, data, updated_at in rows
+                ])
+
+    async def flush(self) -> int:
+        """Записывает измененные состояния одной транзакцией; возвращает число записей"""
+        rows, deletes = self._collect()
+        if not (rows or deletes):
+            return 0
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, rows, deletes)
+        except sqlite3.Error:
+            # Повторим при следующем flush
+            self._dirty.update(key for key, *_ in rows)
+            self._dirty.update(deletes)
+            raise
+        return len(rows) + len(deletes)
+
+    def _expire_rows(self, deadline: float) -> int:
+        with self._db_lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute('DELETE FROM fsm_states WHERE updated_at < ?', (deadline,)).rowcount
+
+    async def expire(self) -> int:
+        """Удаляет брошенные состояния из памяти и базы; возвращает число удаленных в базе"""
+        deadline = time.time() - self.ttl
+        for key in [key for key, record in self._records.items() if record.updated_at < deadline]:
+            if key not in self._dirty:
+                del self._records[key]
+        return await asyncio.get_running_loop().run_in_executor(None, self._expire_rows, deadline)
+
+    async def flush_loop(self, interval: float, expire_interval: float = 3600):
+        """Фоновая задача: периодически записывает изменения и удаляет брошенные состояния"""
+        expired_at = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+                if time.monotonic() - expired_at >= expire_interval:
+                    expired_at = time.monotonic()
+                    await self.expire()
+            except Exception as e:
+                print(f"Ошибка сохранения состояний диалогов: {str(e)}")
+
+    async def close(self) -> None:
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Ошибка сохранения состояний диалогов: {str(e)}")
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,289 @@
+import asyncio
+import base64
+import re
+from typing import Any, AsyncIterator, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+import aiohttp
+
+
+class GLPIError(Exception):
+    """Сетевая ошибка или таймаут при обращении к GLPI API"""
+
+
+class GLPISessionExpired(GLPIError):
+    """GLPI отверг session_token (ERROR_SESSION_TOKEN_INVALID)"""
+
+    def __init__(self, session_token: str):
+        super().__init__('ERROR_SESSION_TOKEN_INVALID')
+        self.session_token = session_token
+
+
+SESSION_ERRORS = ('ERROR_SESSION_TOKEN_INVALID', 'ERROR_SESSION_TOKEN_MISSING')
+
+
+CONTENT_RANGE_RE = re.compile(r'(\d+)-(\d+)/(\d+)')
+
+
+def parse_content_range(value: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """Разбирает заголовок Content-Range вида '0-49/1234' в (начало, конец, всего)"""
+    if not value:
+        return None
+    match = CONTENT_RANGE_RE.search(value)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2)), int(match.group(3))
+
+
+def build_search_params(criteria: List[dict], forcedisplay: List[int], **extra) -> Dict[str, str]:
+    """Собирает параметры /search/ в виде criteria[0][field]=... и forcedisplay[0]=..."""
+    params = {key: str(value) for key, value in extra.items()}
+    for index, criterion in enumerate(criteria):
+        for key, value in criterion.items():
+            params[f'criteria[{index}][{key}]'] = str(value)
+    for index, field in enumerate(forcedisplay):
+        params[f'forcedisplay[{index}]'] = str(field)
+    return params
+
+
+class GLPIClient:
+    """Асинхронный клиент GLPI REST API.
+
+    Все запросы идут через одну aiohttp-сессию с пулом keep-alive соединений,
+    поэтому медленный ответ GLPI не блокирует цикл событий бота.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        app_token: str,
+        timeout: float = 15.0,
+        connect_timeout: float = 5.0,
+        pool_size: int = 100,
+        keepalive_timeout: float = 30.0,
+        max_in_flight: Optional[int] = None,
+    ):
+        self.base_url = (base_url or '').rstrip('/')
+        self.app_token = app_token
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Общий предел одновременных запросов к GLPI от всех задач бота
+        self.max_in_flight = max_in_flight
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        # Токены, которые GLPI уже отверг: запросы с ними не отправляются повторно
+        self.invalid_tokens: Set[str] = set()
+        # Вызывается один раз для каждого отвергнутого токена
+        self.on_session_invalid: Optional[Callable[[str], Any]] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Сессия создается лениво, так как ей нужен запущенный цикл событий
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            if self.max_in_flight:
+                self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def headers(self, session_token: Optional[str] = None) -> Dict[str, str]:
+        headers = {
+            'Content-Type': 'application/json',
+            'App-Token': self.app_token,
+        }
+        if session_token:
+            headers['Session-Token'] = session_token
+        return headers
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        session_token: Optional[str] = None,
+        *,
+        params=None,
+        json: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[int, Any, Mapping[str, str]]:
+        """Выполняет запрос к GLPI и возвращает (статус, разобранный JSON, заголовки ответа).
+
+        Если GLPI отверг session_token, выбрасывает GLPISessionExpired.
+        """
+        if session_token and session_token in self.invalid_tokens:
+            raise GLPISessionExpired(session_token)
+
+        request_headers = self.headers(session_token)
+        if headers:
+            request_headers.update(headers)
+
+        # timeout=None в session.request отключил бы и таймауты сессии, поэтому без своего - общий
+        request_timeout = (
+            aiohttp.ClientTimeout(total=timeout, connect=self.timeout.connect) if timeout else self.timeout
+        )
+        session = self._get_session()
+        try:
+            if self._in_flight is not None:
+                await self._in_flight.acquire()
+            try:
+                async with session.request(
+                    method,
+                    f'{self.base_url}{path}',
+                    headers=request_headers,
+                    params=params,
+                    json=json,
+                    timeout=request_timeout,
+                ) as response:
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError:
+                        data = await response.text()
+                    status, response_headers = response.status, response.headers
+            finally:
+                if self._in_flight is not None:
+                    self._in_flight.release()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise GLPIError(f'{method} {path}: {e!r}') from e
+
+        if session_token and status == 401 and isinstance(data, list) and data and data[0] in SESSION_ERRORS:
+            self.invalidate_token(session_token)
+            raise GLPISessionExpired(session_token)
+        return status, data, response_headers
+
+    def invalidate_token(self, session_token: str):
+        if session_token in self.invalid_tokens:
+            return
+        self.invalid_tokens.add(session_token)
+        if self.on_session_invalid is not None:
+            self.on_session_invalid(session_token)
+
+    async def init_session(self, login: str, password: str) -> Tuple[int, Any]:
+        credentials = base64.b64encode(f'{login}:{password}'.encode()).decode()
+        status, data, _ = await self.request(
+            'GET', '/initSession', headers={'Authorization': f'Basic {credentials}'}
+        )
+        return status, data
+
+    async def get_full_session(self, session_token: str) -> Tuple[int, Any]:
+        status, data, _ = await self.request('GET', '/getFullSession/', session_token)
+        return status, data
+
+    async def get_item(self, session_token: str, itemtype: str, item_id: int, params=None) -> Tuple[int, Any]:
+        status, data, _ = await self.request('GET', f'/{itemtype}/{item_id}', session_token, params=params)
+        return status, data
+
+    async def get_sub_items(
+        self, session_token: str, itemtype: str, item_id: int, sub_itemtype: str, params=None
+    ) -> Tuple[int, Any]:
+        status, data, _ = await self.request(
+            'GET', f'/{itemtype}/{item_id}/{sub_itemtype}', session_token, params=params
+        )
+        return status, data
+
+    async def list_items(self, session_token: str, itemtype: str, params=None) -> Tuple[int, Any, Mapping[str, str]]:
+        return await self.request('GET', f'/{itemtype}', session_token, params=params)
+
+    async def get_multiple_items(self, session_token: str, items: List[Tuple[str, int]]) -> Tuple[int, Any]:
+        """Получает несколько объектов за один запрос (GET /getMultipleItems)"""
+        params = {}
+        for index, (itemtype, item_id) in enumerate(items):
+            params[f'items[{index}][itemtype]'] = itemtype
+            params[f'items[{index}][items_id]'] = str(item_id)
+        status, data, _ = await self.request('GET', '/getMultipleItems', session_token, params=params)
+        return status, data
+
+    async def add_item(self, session_token: str, itemtype: str, item_input: dict) -> Tuple[int, Any]:
+        status, data, _ = await self.request('POST', f'/{itemtype}', session_token, json={'input': item_input})
+        return status, data
+
+    async def get_page(
+        self, session_token: str, path: str, params=None, start: int = 0, limit: int = 50
+    ) -> Tuple[Any, Optional[Tuple[int, int, int]]]:
+        """Одна страница выдачи через параметр range: (данные, разобранный Content-Range).
+
+        Если страница за пределами выдачи, возвращает (None, None).
+        """
+        page_params = dict(params or {})
+        page_params['range'] = f'{start}-{start + limit - 1}'
+        status, data, headers = await self.request('GET', path, session_token, params=page_params)
+
+        # GLPI отвечает 400 ERROR_RANGE_EXCEED_TOTAL, если страниц больше нет
+        if status == 400 and isinstance(data, list) and 'ERROR_RANGE_EXCEED_TOTAL' in data:
+            return None, None
+        if status not in (200, 206):
+            raise GLPIError(f'GET {path}: {status} {data}')
+        return data, parse_content_range(headers.get('Content-Range'))
+
+    async def iter_pages(
+        self, session_token: str, path: str, params=None, page_size: int = 50
+    ) -> AsyncIterator[Tuple[Any, Optional[Tuple[int, int, int]]]]:
+        """Обходит выдачу GLPI страницами через параметр range.
+
+        Каждая страница отдается сразу после получения, поэтому в памяти
+        одновременно находится не больше одной страницы.
+        """
+        start = 0
+        while True:
+            data, content_range = await self.get_page(session_token, path, params, start, page_size)
+            if data is None:
+                return
+
+            yield data, content_range
+
+            if content_range is None:
+                return
+            _, end, total = content_range
+            if end + 1 >= total:
+                return
+            start = end + 1
+
+    async def list_page(
+        self, session_token: str, itemtype: str, params=None, start: int = 0, limit: int = 50
+    ) -> Tuple[List[dict], int]:
+        """Одна страница объектов itemtype: (объекты, всего объектов)"""
+        data, content_range = await self.get_page(session_token, f'/{itemtype}', params, start, limit)
+        if not data:
+            return [], 0
+        return data, content_range[2] if content_range else start + len(data)
+
+    async def search_page(
+        self, session_token: str, itemtype: str, criteria: List[dict], forcedisplay: List[int],
+        start: int = 0, limit: int = 50, **extra
+    ) -> Tuple[List[dict], int]:
+        """Одна страница /search/itemtype: (строки, всего найдено)"""
+        params = build_search_params(criteria, forcedisplay, **extra)
+        data, _ = await self.get_page(session_token, f'/search/{itemtype}', params, start, limit)
+        if not isinstance(data, dict) or not data.get('data'):
+            return [], 0
+        return data['data'], int(data.get('totalcount', start + len(data['data'])))
+
+    async def iter_items(
+        self, session_token: str, itemtype: str, params=None, page_size: int = 50
+    ) -> AsyncIterator[List[dict]]:
+        """Постранично отдает объекты itemtype (GET /itemtype)"""
+        async for page, _ in self.iter_pages(session_token, f'/{itemtype}', params=params, page_size=page_size):
+            if not page:
+                return
+            yield page
+
+    async def iter_search(
+        self, session_token: str, itemtype: str, criteria: List[dict], forcedisplay: List[int],
+        page_size: int = 50, **extra
+    ) -> AsyncIterator[List[dict]]:
+        """Постранично отдает строки /search/itemtype.
+
+        Строки содержат только колонки из forcedisplay, ключи - номера полей поиска GLPI.
+        """
+        params = build_search_params(criteria, forcedisplay, **extra)
+        async for page, _ in self.iter_pages(session_token, f'/search/{itemtype}', params=params, page_size=page_size):
+            rows = page.get('data') if isinstance(page, dict) else None
+            if not rows:
+                return
+            yield rows
@@ -0,0 +1,105 @@
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+
+def parse_full_session(data: dict) -> dict:
+    """Извлекает из ответа /getFullSession то, что не меняется за время жизни сессии"""
+    session = data.get('session', {}) if isinstance(data, dict) else {}
+    active_profile = session.get('glpiactiveprofile') or {}
+    active_entities = session.get('glpiactiveentities') or []
+    if isinstance(active_entities, dict):
+        active_entities = list(active_entities.values())
+
+    return {
+        'glpi_id': session.get('glpiID'),
+        'profile': active_profile.get('name', 'Normal'),
+        'profile_id': active_profile.get('id'),
+        'active_entity': session.get('glpiactive_entity'),
+        'entities': [int(entity_id) for entity_id in active_entities],
+        'is_recursive': bool(session.get('glpiactive_entity_recursive')),
+    }
+
+
+class SessionManager:
+    """Сессии GLPI пользователей Telegram.
+
+    Хранит session_token вместе с данными из /getFullSession (glpiID, профиль,
+    сущности), чтобы не запрашивать их повторно. Сессия, токен которой GLPI
+    отверг, помечается устаревшей: опрос ее пропускает, а пользователю
+    предлагается авторизоваться заново. Если передан store (StateStore),
+    изменения сессий сохраняются в нем и переживают перезапуск бота.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self._sessions: Dict[int, dict] = {}
+        self._by_token: Dict[str, int] = {}
+
+    def restore(self, sessions: Dict[int, dict]):
+        """Восстанавливает сессии, сохраненные при прошлом запуске"""
+        for telegram_id, session_data in sessions.items():
+            self._sessions[telegram_id] = session_data
+            self._by_token[session_data.get('session_token')] = telegram_id
+
+    def save(self, telegram_id: int):
+        """Сохраняет сессию после изменения ее полей"""
+        session_data = self._sessions.get(telegram_id)
+        if session_data is not None and self.store is not None:
+            self.store.save_session(telegram_id, session_data)
+
+    def __setitem__(self, telegram_id: int, session_data: dict):
+        previous = self._sessions.get(telegram_id)
+        if previous is not None:
+            self._by_token.pop(previous.get('session_token'), None)
+
+        session_data.setdefault('stale', False)
+        session_data.setdefault('created_at', time.time())
+        self._sessions[telegram_id] = session_data
+        self._by_token[session_data.get('session_token')] = telegram_id
+        self.save(telegram_id)
+
+    def get(self, telegram_id: int, default=None) -> Optional[dict]:
+        """Возвращает действующую сессию пользователя (устаревшие не возвращаются)"""
+        session_data = self._sessions.get(telegram_id)
+        if session_data is None or session_data.get('stale'):
+            return default
+        return session_data
+
+    def pop(self, telegram_id: int, default=None) -> Optional[dict]:
+        session_data = self._sessions.pop(telegram_id, None)
+        if session_data is None:
+            return default
+        self._by_token.pop(session_data.get('session_token'), None)
+        if self.store is not None:
+            self.store.delete_session(telegram_id)
+        return session_data
+
+    def items(self) -> Iterator[Tuple[int, dict]]:
+        """Действующие сессии; итерация идет по снимку, поэтому словарь можно менять во время обхода"""
+        for telegram_id, session_data in list(self._sessions.items()):
+            if not session_data.get('stale'):
+                yield telegram_id, session_data
+
+    def stale_items(self) -> Iterator[Tuple[int, dict]]:
+        for telegram_id, session_data in list(self._sessions.items()):
+            if session_data.get('stale'):
+                yield telegram_id, session_data
+
+    def mark_stale(self, session_token: str) -> Optional[int]:
+        """Помечает сессию с этим токеном устаревшей и возвращает Telegram ID ее владельца"""
+        telegram_id = self._by_token.get(session_token)
+        if telegram_id is None:
+            return None
+        session_data = self._sessions[telegram_id]
+        if not session_data.get('stale'):
+            session_data['stale'] = True
+            session_data['stale_since'] = time.time()
+            self.save(telegram_id)
+            print(f"Сессия GLPI пользователя {telegram_id} истекла")
+        return telegram_id
+
+    def __contains__(self, telegram_id: int) -> bool:
+        return self.get(telegram_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,11 @@
+import hashlib
+import hmac
+
+# Заголовки подписи вебхука GLPI 10
+SIGNATURE_HEADER = 'X-GLPI-signature'
+TIMESTAMP_HEADER = 'X-GLPI-timestamp'
+
+
+def sign_payload(body: bytes, timestamp: str, secret: str) -> str:
+    """Подпись GLPI: HMAC-SHA256 от тела запроса, к которому дописано время отправки"""
+    return hmac.new(secret.encode(), body + timestamp.encode(), hashlib.sha256).hexdigest()
@@ -0,0 +1,120 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from utils.embedding_cache import normalize_text
+
+
+class EmbeddingQueueFull(Exception):
+    """Очередь сервиса эмбеддингов переполнена"""
+
+
+class EmbeddingService:
+    """Вычисление эмбеддингов вне цикла событий.
+
+    Запросы складываются в очередь, воркер собирает их в микропакеты (не больше
+    max_batch_size текстов, ожидая новые запросы не дольше batch_window секунд)
+    и выполняет encode_fn в пуле потоков. Вызывающий код получает awaitable-результат.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 32,
+        batch_window: float = 0.01,
+        max_queue_size: int = 256,
+        workers: int = 1,
+        cache=None,
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_queue_size = max_queue_size
+        self.workers = workers
+        # Необязательный кэш (EmbeddingCache): попадания отдаются без постановки в очередь
+        self.cache = cache
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _ensure_started(self):
+        # Очередь и воркеры создаются при первом запросе, внутри работающего цикла событий
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='embeddings')
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._queue = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def encode(self, text: str) -> np.ndarray:
+        """Возвращает эмбеддинг одного текста; при переполненной очереди выбрасывает EmbeddingQueueFull"""
+        if self.cache is not None:
+            # Промах учтет encode_fn, который проверяет кэш еще раз перед кодированием
+            embedding = self.cache.get(normalize_text(text), count_miss=False)
+            if embedding is not None:
+                return embedding
+
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((text, future))
+        except asyncio.QueueFull:
+            raise EmbeddingQueueFull(f'В очереди уже {self.queue_depth} запросов')
+        return await future
+
+    async def encode_many(self, texts: List[str]) -> np.ndarray:
+        """Эмбеддинги нескольких текстов (строки матрицы в порядке texts)"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        embeddings = await asyncio.gather(*(self.encode(text) for text in texts))
+        return np.vstack(embeddings)
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        # Даем подойти параллельным запросам, если пакет еще не набран
+        if self.batch_window > 0 and self._queue.qsize() < self.max_batch_size - 1:
+            await asyncio.sleep(self.batch_window)
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            # Запросы, которые уже отменены вызывающей стороной, не считаем
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            try:
+                embeddings = await loop.run_in_executor(
+                    self._executor, self.encode_fn, [text for text, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
@@ -0,0 +1,229 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramNotFound,
+    TelegramRetryAfter, TelegramServerError,
+)
+
+# Как часто удалять ограничители чатов, которым нечего отправлять и у которых восстановились токены
+BUCKET_SWEEP_INTERVAL = 60
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """Сколько секунд ждать до появления токена (0 - токен есть)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class OutgoingMessage:
+    __slots__ = ('bot', 'chat_id', 'text', 'kwargs', 'description', 'attempts')
+
+    def __init__(self, bot: Bot, chat_id: int, text: str, kwargs: dict, description: str):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.description = description
+        self.attempts = 0
+
+
+class NotificationOutbox:
+    """Очередь исходящих уведомлений с ограничением частоты отправки.
+
+    Сообщения копятся в очередях по чатам; воркеры берут чат, для которого
+    есть токены и в общем ограничителе, и в ограничителе чата, и отправляют
+    его сообщения по порядку. Чат одновременно обрабатывает только один воркер,
+    поэтому порядок уведомлений в чате сохраняется. На TelegramRetryAfter
+    отправка приостанавливается на указанное Telegram время, временные ошибки
+    повторяются с растущей паузой не больше max_retries раз.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 25,
+        global_burst: float = 5,
+        per_chat_rate: float = 1,
+        per_chat_burst: float = 3,
+        workers: int = 4,
+        max_retries: int = 5,
+        max_pending: int = 10000,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.sent = 0
+        self.dropped = 0
+        self._chats: Dict[int, Deque[OutgoingMessage]] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._pending = 0
+        self._paused_until = 0.0
+        self._swept_at = time.monotonic()
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_started(self):
+        # Очередь и воркеры создаются при первом сообщении, внутри работающего цикла событий
+        if self._ready is not None:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def enqueue(self, bot: Bot, chat_id: int, text: str, description: str = 'уведомления', **kwargs) -> bool:
+        """Ставит сообщение в очередь; kwargs передаются в bot.send_message. False - очередь переполнена"""
+        if self._pending >= self.max_pending:
+            self.dropped += 1
+            print(f"Очередь уведомлений переполнена, {description} пользователю {chat_id} не отправлено")
+            return False
+        self._ensure_started()
+        self._sweep_buckets()
+        self._pending += 1
+        chat_queue = self._chats.get(chat_id)
+        if chat_queue is None:
+            # Чат, которого нет в _chats, не стоит в очереди готовых и не обрабатывается воркером
+            self._chats[chat_id] = deque([OutgoingMessage(bot, chat_id, text, kwargs, description)])
+            self._ready.put_nowait(chat_id)
+        else:
+            chat_queue.append(OutgoingMessage(bot, chat_id, text, kwargs, description))
+        return True
+
+    def _schedule(self, chat_id: int, delay: float):
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    def _sweep_buckets(self):
+        """Удаляет ограничители простаивающих чатов. Ограничитель чата, у которого
+        кончились токены, нужен, пока они не восстановятся, поэтому сразу после
+        отправки он не удаляется"""
+        now = time.monotonic()
+        if now - self._swept_at < BUCKET_SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        for chat_id in [chat_id for chat_id in self._buckets if chat_id not in self._chats]:
+            if self._buckets[chat_id].is_full():
+                del self._buckets[chat_id]
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    async def _wait_global(self):
+        while True:
+            delay = max(self._paused_until - time.monotonic(), self.global_bucket.delay())
+            if delay <= 0:
+                self.global_bucket.take()
+                return
+            await asyncio.sleep(delay)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            chat_queue = self._chats.get(chat_id)
+            if not chat_queue:
+                self._chats.pop(chat_id, None)
+                continue
+
+            bucket = self._bucket(chat_id)
+            delay = bucket.delay()
+            if delay > 0:
+                self._schedule(chat_id, delay)
+                continue
+            await self._wait_global()
+            bucket.take()
+
+            message = chat_queue[0]
+            retry_delay = await self._send(message)
+            if retry_delay is None:
+                chat_queue.popleft()
+                self._pending -= 1
+            if chat_queue:
+                self._schedule(chat_id, retry_delay or 0)
+            else:
+                del self._chats[chat_id]
+
+    async def _send(self, message: OutgoingMessage) -> Optional[float]:
+        """Отправляет сообщение; возвращает паузу перед повтором или None, если повторять не нужно"""
+        try:
+            await message.bot.send_message(message.chat_id, message.text, **message.kwargs)
+            self.sent += 1
+            return None
+        except TelegramRetryAfter as e:
+            # Флуд-контроль Telegram: приостанавливаем все отправки, сообщение не теряем
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            print(f"Telegram ограничил частоту отправки, пауза {e.retry_after} с")
+            return self._retry(message, e, float(e.retry_after))
+        except (TelegramForbiddenError, TelegramBadRequest, TelegramNotFound) as e:
+            # Бот заблокирован, чат удален или сообщение некорректно - повтор не поможет
+            self.dropped += 1
+            print(f"Ошибка отправки {message.description} пользователю {message.chat_id}: {str(e)}")
+            return None
+        except (TelegramNetworkError, TelegramServerError) as e:
+            return self._retry(message, e, min(2 ** (message.attempts + 1), 60))
+        except Exception as e:
+            self.dropped += 1
+            print(f"Ошибка отправки {message.description} пользователю {message.chat_id}: {str(e)}")
+            return None
+
+    def _retry(self, message: OutgoingMessage, error: Exception, delay: float) -> Optional[float]:
+        message.attempts += 1
+        if message.attempts > self.max_retries:
+            self.dropped += 1
+            print(f"Ошибка отправки {message.description} пользователю {message.chat_id} "
+                  f"после {self.max_retries} повторов: {str(error)}")
+            return None
+        return delay
+
+    async def drain(self, timeout: float):
+        """Ждет отправки накопленных сообщений, но не дольше timeout секунд"""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._ready = None
+        if self._pending:
+            print(f"Не отправлено уведомлений: {self._pending}")
+        self._chats.clear()
+        self._pending = 0
@@ -0,0 +1,146 @@
+import os
+import re
+from html import unescape
+from typing import List, Optional
+
+from utils.cache import TTLCache
+
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+TELEGRAM_ID_RE = re.compile(r"Telegram \(ID: (\d+)\)")
+# Части описания заявки, созданной ботом, которые выводятся с новой строки
+SECTION_RE = re.compile(
+    r"(Заявка от пользователя Telegram|Категория \(определено автоматически\):|Описание проблемы:)"
+)
+
+STATUS_NAMES = {
+    1: "🆕 Новая",
+    2: "🔄 В работе(назначена)",
+    3: "☑️ В работе(запланирована)",
+    4: "⏳ В ожидании",
+    5: "✅ Решена",
+    6: "❌ Закрыта",
+}
+URGENCY_NAMES = {
+    1: "🟢 Очень низкая",
+    2: "🟡 Низкая",
+    3: "🟠 Средняя",
+    4: "🚨 Высокая",
+    5: "⚡ Очень высокая",
+}
+IMPACT_NAMES = {
+    1: "🟢 Очень низкое",
+    2: "🟡 Низкое",
+    3: "🟠 Среднее",
+    4: "🚨 Высокое",
+    5: "⚡ Очень высокое",
+}
+TYPE_NAMES = {
+    1: "Инцидент",
+    2: "Запрос",
+}
+
+# Максимальная длина сообщения Telegram (4096) с запасом
+MESSAGE_LIMIT = 4000
+
+# Очищенное описание и карточка заявки: {(ID заявки, date_mod): {'content': ..., 'card': ...}}.
+# Любое изменение заявки в GLPI меняет date_mod, поэтому запись не устаревает, а только вытесняется
+rendered_tickets = TTLCache(maxsize=int(os.getenv('render_cache_size', 2048)))
+
+
+def get_status_name(status_id):
+    """Преобразует ID статуса в читаемое название"""
+    return STATUS_NAMES.get(status_id, f"❓ Неизвестный статус ({status_id})")
+
+
+def get_urgency_name(urgency_id):
+    return URGENCY_NAMES.get(urgency_id, f"❓ Неизвестная срочность ({urgency_id})")
+
+
+def get_impact_name(impact_id):
+    return IMPACT_NAMES.get(impact_id, f"❓ Неизвестное влияение ({impact_id})")
+
+
+def get_type_name(type_id):
+    return TYPE_NAMES.get(type_id, f"❓ Неизвестный тип ({type_id})")
+
+
+def clean_html_content(text):
+    """Удаляет HTML-теги и преобразует HTML-сущности в нормальные символы"""
+    if not text:
+        return ""
+    # Заменяем HTML-сущности, удаляем теги и лишние пробелы и переносы строк
+    return ' '.join(HTML_TAG_RE.sub('', unescape(text)).split())
+
+
+def find_telegram_id_in_content(content: str) -> Optional[int]:
+    """Ищет Telegram ID в содержимом заявки"""
+    if not content:
+        return None
+    match = TELEGRAM_ID_RE.search(content)
+    return int(match.group(1)) if match else None
+
+
+def _ticket_entry(ticket: dict) -> Optional[dict]:
+    ticket_id, date_mod = ticket.get('id'), ticket.get('date_mod')
+    if ticket_id is None or not date_mod:
+        return None
+    key = (ticket_id, date_mod)
+    entry = rendered_tickets.get(key)
+    if entry is None:
+        entry = {}
+        rendered_tickets.set(key, entry)
+    return entry
+
+
+def clean_ticket_content(ticket: dict) -> str:
+    """Очищенное описание заявки; для той же версии заявки (ID, date_mod) берется из кэша"""
+    entry = _ticket_entry(ticket)
+    if entry is None:
+        return clean_html_content(ticket.get('content'))
+    if 'content' not in entry:
+        entry['content'] = clean_html_content(ticket.get('content'))
+    return entry['content']
+
+
+def render_ticket_card(ticket: dict) -> str:
+    # Добавляем переносы строк для ключевых частей
+    content = clean_ticket_content(ticket) if 'content' in ticket else 'Нет описания'
+    content = SECTION_RE.sub(r'\n\1', content)
+    # Обрезаем длинное описание до 200 символов
+    short_content = (content[:200] + '...') if len(content) > 200 else content
+
+    return (
+        f"🔹 #{ticket.get('id', 'N/A')}\n"
+        f"📌 Тема: {ticket.get('name', 'Без названия')}\n"
+        f"📝 Описание: {short_content}\n"
+        f"🔄 Статус: {get_status_name(ticket.get('status', 0))}\n"
+        f"📅 Дата создания: {ticket.get('date', 'N/A')}\n"
+        f"⚠️ Срочность: {get_urgency_name(ticket.get('urgency', 0))}\n"
+        f"🔔 Тип: {get_type_name(ticket.get('type', 0))}\n"
+        f"────────────────────"
+    )
+
+
+def format_ticket(ticket):
+    """Карточка заявки для списка заявок (кэшируется по ID и date_mod)"""
+    entry = _ticket_entry(ticket)
+    if entry is None:
+        return render_ticket_card(ticket)
+    if 'card' not in entry:
+        entry['card'] = render_ticket_card(ticket)
+    return entry['card']
+
+
+def split_entries(header: str, entries: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Собирает записи в сообщения не длиннее limit, не разрывая записи между сообщениями"""
+    messages = []
+    current = header
+    for entry in entries:
+        entry = entry[:limit]
+        if current and len(current) + len(entry) + 1 > limit:
+            messages.append(current)
+            current = ''
+        current = f"{current}\n{entry}" if current else entry
+    if current:
+        messages.append(current)
+    return messages
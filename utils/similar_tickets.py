@@ -0,0 +1,100 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+
+from utils.categorizer import DATA_DIR, embedding_cache, embedding_service
+from utils.ticket_index import TicketIndex
+
+# Сходство, начиная с которого заявка считается вероятным дублем
+DUPLICATE_THRESHOLD = float(os.getenv('duplicate_threshold', 0.85))
+# Сколько заявок из ленты опроса индексируется за один проход и как часто
+INDEX_BATCH_SIZE = int(os.getenv('ticket_index_batch_size', 128))
+INDEX_INTERVAL = float(os.getenv('ticket_index_interval', 30))
+# Предел очереди на индексацию: при первом опросе в ленту попадают все заявки,
+# и целиком они в памяти не держатся. Не попавшие в очередь заявки
+# индексируются, когда снова изменятся
+PENDING_MAX = int(os.getenv('ticket_index_pending_max', 2000))
+# Модель все равно обрезает длинный текст, поэтому в очереди хранится только его начало
+PENDING_TEXT_MAX = 2000
+
+ticket_index = TicketIndex(os.path.join(DATA_DIR, 'tickets'))
+
+# Заявки из ленты опроса, которые еще не проиндексированы: {ID: (текст, метаданные)}
+pending_tickets: Dict[int, Tuple[str, dict]] = {}
+# Сколько заявок не попало в переполненную очередь
+pending_dropped = 0
+
+
+def ticket_text(name: Optional[str], content: Optional[str]) -> str:
+    """Текст для эмбеддинга: тема и описание без служебного заголовка бота"""
+    description = content or ''
+    if 'Описание проблемы:' in description:
+        description = description.split('Описание проблемы:', 1)[1]
+    return f"{name or ''}: {description.strip()}"
+
+
+def observe_ticket(ticket_id: int, name: Optional[str], content: Optional[str], status, owner: Optional[int]):
+    """Учитывает заявку из ленты опроса: новую ставит в очередь на индексацию, у известной обновляет статус"""
+    global pending_dropped
+    meta = {'name': name, 'status': status, 'owner': owner}
+    if ticket_id in ticket_index:
+        ticket_index.update_meta(ticket_id, **meta)
+    elif ticket_id in pending_tickets or len(pending_tickets) < PENDING_MAX:
+        pending_tickets[ticket_id] = (ticket_text(name, content)[:PENDING_TEXT_MAX], meta)
+    else:
+        pending_dropped += 1
+
+
+async def add_ticket(ticket_id: int, text: str, meta: dict):
+    """Сразу добавляет в индекс только что созданную заявку"""
+    embedding = await embedding_service.encode(text)
+    await asyncio.get_running_loop().run_in_executor(
+        None, ticket_index.add, [ticket_id], embedding.reshape(1, -1), [meta]
+    )
+    pending_tickets.pop(ticket_id, None)
+
+
+async def find_similar(text: str, telegram_id: int, see_all: bool, k: int = 3) -> List[Tuple[int, float, dict]]:
+    """Ищет вероятные дубли; пользователю без прав на все заявки показываются только его собственные"""
+    if len(ticket_index) == 0:
+        return []
+    embedding = await embedding_service.encode(text)
+    # Берем с запасом, так как часть результатов может отсеяться по владельцу
+    matches = await asyncio.get_running_loop().run_in_executor(
+        None, ticket_index.search, embedding, k * 4, DUPLICATE_THRESHOLD
+    )
+    if not see_all:
+        matches = [match for match in matches if match[2].get('owner') == telegram_id]
+    return matches[:k]
+
+
+async def index_pending_tickets():
+    """Индексирует накопленные заявки пачками; при ошибке заявки остаются в очереди"""
+    loop = asyncio.get_running_loop()
+    # Заявки, которые попали в очередь до загрузки индекса с диска, повторно не кодируем
+    for ticket_id in [ticket_id for ticket_id in pending_tickets if ticket_id in ticket_index]:
+        ticket_index.update_meta(ticket_id, **pending_tickets.pop(ticket_id)[1])
+
+    while pending_tickets:
+        ticket_ids = list(pending_tickets)[:INDEX_BATCH_SIZE]
+        texts = [pending_tickets[ticket_id][0] for ticket_id in ticket_ids]
+        metas = [pending_tickets[ticket_id][1] for ticket_id in ticket_ids]
+        embeddings = await embedding_service.encode_many(texts)
+        await loop.run_in_executor(None, ticket_index.add, ticket_ids, embeddings, metas)
+        for ticket_id in ticket_ids:
+            pending_tickets.pop(ticket_id, None)
+
+
+async def index_tickets_loop():
+    """Фоновая задача: загружает индекс с диска, затем дополняет его заявками из ленты
+    и сохраняет вместе с кэшем эмбеддингов"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, ticket_index.load)
+    while True:
+        try:
+            await index_pending_tickets()
+            await loop.run_in_executor(None, ticket_index.save)
+            await loop.run_in_executor(None, embedding_cache.save)
+        except Exception as e:
+            print(f"Ошибка индексации заявок: {str(e)}")
+        await asyncio.sleep(INDEX_INTERVAL)
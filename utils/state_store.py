@@ -0,0 +1,223 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    telegram_id INTEGER PRIMARY KEY,
+    token BLOB NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ticket_states (
+    ticket_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    telegram_id INTEGER PRIMARY KEY,
+    watermark TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_settings (
+    telegram_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ticket_owners (
+    ticket_id INTEGER PRIMARY KEY,
+    telegram_id INTEGER NOT NULL
+);
+'''
+
+
+class StateStore:
+    """Состояние бота в SQLite: сессии GLPI, последние состояния заявок, отметки опроса,
+    настройки пользователей и владельцы заявок.
+
+    Изменения копятся в памяти и записываются пачкой одной транзакцией
+    (flush), поэтому опрос не ждет диска. Токены сессий хранятся
+    зашифрованными (Fernet); без ключа шифрования сессии не сохраняются.
+    """
+
+    def __init__(self, path: str, encryption_key: Optional[str] = None):
+        self.path = path
+        self.fernet = Fernet(encryption_key.encode()) if encryption_key else None
+        self._conn: Optional[sqlite3.Connection] = None
+        # Соединение используется из потоков пула, а очереди изменений - из цикла событий
+        self._db_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        # None в очереди - удаление записи
+        self._pending_sessions: Dict[int, Optional[dict]] = {}
+        self._pending_tickets: Dict[int, Optional[dict]] = {}
+        self._pending_watermarks: Dict[int, str] = {}
+        self._pending_settings: Dict[int, dict] = {}
+        self._pending_owners: Dict[int, int] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # Изменения (только в памяти до flush)
+
+    def save_session(self, telegram_id: int, session_data: dict):
+        if self.fernet is None:
+            return
+        with self._pending_lock:
+            self._pending_sessions[telegram_id] = dict(session_data)
+
+    def delete_session(self, telegram_id: int):
+        with self._pending_lock:
+            self._pending_sessions[telegram_id] = None
+
+    def save_ticket(self, ticket_id: int, state: dict):
+        with self._pending_lock:
+            self._pending_tickets[ticket_id] = state
+
+    def delete_ticket(self, ticket_id: int):
+        with self._pending_lock:
+            self._pending_tickets[ticket_id] = None
+
+    def save_watermark(self, telegram_id: int, watermark: str):
+        with self._pending_lock:
+            self._pending_watermarks[telegram_id] = watermark
+
+    def save_settings(self, telegram_id: int, settings: dict):
+        with self._pending_lock:
+            self._pending_settings[telegram_id] = dict(settings)
+
+    def save_owner(self, ticket_id: int, telegram_id: int):
+        with self._pending_lock:
+            self._pending_owners[ticket_id] = telegram_id
+
+    @property
+    def pending(self) -> int:
+        return (
+            len(self._pending_sessions) + len(self._pending_tickets)
+            + len(self._pending_watermarks) + len(self._pending_settings) + len(self._pending_owners)
+        )
+
+    def flush(self) -> int:
+        """Записывает накопленные изменения одной транзакцией; возвращает число записей"""
+        with self._pending_lock:
+            sessions, self._pending_sessions = self._pending_sessions, {}
+            tickets, self._pending_tickets = self._pending_tickets, {}
+            watermarks, self._pending_watermarks = self._pending_watermarks, {}
+            settings, self._pending_settings = self._pending_settings, {}
+            owners, self._pending_owners = self._pending_owners, {}
+        if not (sessions or tickets or watermarks or settings or owners):
+            return 0
+
+        now = time.time()
+        session_rows, session_deletes = [], []
+        for telegram_id, session_data in sessions.items():
+            if session_data is None:
+                session_deletes.append((telegram_id,))
+                continue
+            data = {key: value for key, value in session_data.items() if key != 'session_token'}
+            token = self.fernet.encrypt(session_data['session_token'].encode())
+            session_rows.append((telegram_id, token, json.dumps(data, ensure_ascii=False), now))
+        ticket_rows = [
+            (ticket_id, json.dumps(state, ensure_ascii=False), now)
+            for ticket_id, state in tickets.items() if state is not None
+        ]
+        ticket_deletes = [(ticket_id,) for ticket_id, state in tickets.items() if state is None]
+
+        try:
+            with self._db_lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany('DELETE FROM sessions WHERE telegram_id = ?', session_deletes)
+                    conn.executemany('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)', session_rows)
+                    conn.executemany('DELETE FROM ticket_states WHERE ticket_id = ?', ticket_deletes)
+                    conn.executemany('INSERT OR REPLACE INTO ticket_states VALUES (?, ?, ?)', ticket_rows)
+                    conn.executemany('INSERT OR REPLACE INTO watermarks VALUES (?, ?)', list(watermarks.items()))
+                    conn.executemany('INSERT OR REPLACE INTO user_settings VALUES (?, ?)', [
+                        (telegram_id, json.dumps(data, ensure_ascii=False)) for telegram_id, data in settings.items()
+                    ])
+                    conn.executemany('INSERT OR REPLACE INTO ticket_owners VALUES (?, ?)', list(owners.items()))
+        except sqlite3.Error:
+            # Возвращаем изменения в очередь, более новые версии записей не затираем
+            with self._pending_lock:
+                for pending, batch in (
+                    (self._pending_sessions, sessions),
+                    (self._pending_tickets, tickets),
+                    (self._pending_watermarks, watermarks),
+                    (self._pending_settings, settings),
+                    (self._pending_owners, owners),
+                ):
+                    for key, value in batch.items():
+                        pending.setdefault(key, value)
+            raise
+        return len(sessions) + len(tickets) + len(watermarks) + len(settings) + len(owners)
+
+    # Загрузка при старте
+
+    def load_sessions(self) -> Dict[int, dict]:
+        """Сессии с расшифрованными токенами; без ключа или при смене ключа - пусто"""
+        if self.fernet is None:
+            return {}
+        with self._db_lock:
+            rows = self._connect().execute('SELECT telegram_id, token, data FROM sessions').fetchall()
+        sessions = {}
+        for telegram_id, token, data in rows:
+            try:
+                session_token = self.fernet.decrypt(token).decode()
+            except InvalidToken:
+                continue
+            sessions[telegram_id] = {'session_token': session_token, **json.loads(data)}
+        return sessions
+
+    def load_watermarks(self) -> Dict[int, str]:
+        with self._db_lock:
+            return dict(self._connect().execute('SELECT telegram_id, watermark FROM watermarks').fetchall())
+
+    def load_settings(self) -> Dict[int, dict]:
+        with self._db_lock:
+            rows = self._connect().execute('SELECT telegram_id, data FROM user_settings').fetchall()
+        return {telegram_id: json.loads(data) for telegram_id, data in rows}
+
+    def load_owners(self) -> Dict[int, int]:
+        with self._db_lock:
+            return dict(self._connect().execute('SELECT ticket_id, telegram_id FROM ticket_owners').fetchall())
+
+    def load_ticket_states(self, ticket_ids: Iterable[int]) -> Dict[int, dict]:
+        """Состояния только указанных заявок"""
+        ticket_ids = list(ticket_ids)
+        states = {}
+        with self._db_lock:
+            conn = self._connect()
+            # SQLite ограничивает число параметров запроса
+            for start in range(0, len(ticket_ids), 500):
+                chunk = ticket_ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT ticket_id, state FROM ticket_states WHERE ticket_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                states.update((ticket_id, json.loads(state)) for ticket_id, state in rows)
+        return states
+
+    async def flush_loop(self, interval: float):
+        """Фоновая задача: периодически записывает накопленные изменения"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception as e:
+                print(f"Ошибка сохранения состояния бота: {str(e)}")
@@ -0,0 +1,227 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+import faiss
+import numpy as np
+
+# Журнал изменений метаданных сворачивается в снимок, когда в нем больше записей,
+# чем заявок в индексе (но не меньше этого числа)
+META_LOG_COMPACT_MIN = 1000
+
+
+class ReadWriteLock:
+    """Блокировка индекса: поиск и сериализация только читают его и идут параллельно,
+    добавление векторов ждет, пока читатели закончат"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class TicketIndex:
+    """FAISS-индекс эмбеддингов заявок для поиска похожих и дублирующих заявок.
+
+    Используется HNSW-граф по скалярному произведению нормированных векторов
+    (косинусное сходство): новые заявки добавляются без перестроения индекса,
+    а поиск по сотням тысяч векторов занимает миллисекунды. Рядом с индексом
+    хранятся метаданные заявок (тема, статус, владелец), которые обновляются
+    без пересчета эмбеддингов.
+
+    Индекс перезаписывается на диске, только если в него добавлялись векторы;
+    изменения метаданных дописываются в журнал (.meta.jsonl), который время от
+    времени сворачивается в снимок (.meta.json). Индекс сериализуется в память
+    под блокировкой чтения, параллельно с поиском, а файлы пишутся уже без нее.
+    """
+
+    def __init__(self, path_prefix: str, hnsw_neighbors: int = 32, ef_search: int = 64):
+        self.index_path = f'{path_prefix}.faiss'
+        self.meta_path = f'{path_prefix}.meta.json'
+        self.meta_log_path = f'{path_prefix}.meta.jsonl'
+        self.hnsw_neighbors = hnsw_neighbors
+        self.ef_search = ef_search
+        self.index: Optional[faiss.Index] = None
+        self.meta: Dict[int, dict] = {}
+        # Векторы добавлялись после последнего сохранения индекса
+        self.vectors_dirty = False
+        # Заявки, метаданные которых еще не записаны в журнал
+        self._meta_changed: Set[int] = set()
+        self._meta_log_entries = 0
+        # _lock - индекс FAISS, _meta_lock - метаданные и список их изменений,
+        # _save_lock - не дает двум сохранениям писать файлы одновременно
+        self._lock = ReadWriteLock()
+        self._meta_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def _create_index(self, dim: int) -> faiss.Index:
+        hnsw = faiss.IndexHNSWFlat(dim, self.hnsw_neighbors, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efSearch = self.ef_search
+        return faiss.IndexIDMap(hnsw)
+
+    def load(self):
+        """Загружает индекс, снимок метаданных и журнал их изменений, если они есть"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            index = faiss.read_index(self.index_path)
+            faiss.downcast_index(index.index).hnsw.efSearch = self.ef_search
+            meta = {}
+            if os.path.exists(self.meta_path):
+                with open(self.meta_path, encoding='utf-8') as f:
+                    meta = {int(ticket_id): ticket_meta for ticket_id, ticket_meta in json.load(f).items()}
+            log_entries = 0
+            if os.path.exists(self.meta_log_path):
+                with open(self.meta_log_path, encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            ticket_id, ticket_meta = json.loads(line)
+                        except ValueError:
+                            # Строка, недописанная при аварийной остановке
+                            continue
+                        meta[int(ticket_id)] = ticket_meta
+                        log_entries += 1
+            with self._lock.write(), self._meta_lock:
+                self.index, self.meta = index, meta
+                self._meta_log_entries = log_entries
+            print(f"Загружен индекс похожих заявок: {len(self.meta)} заявок")
+        except Exception as e:
+            print(f"Не удалось загрузить индекс заявок: {str(e)}")
+            self.index, self.meta = None, {}
+
+    def save(self):
+        """Сохраняет изменения: индекс - если добавлялись векторы, метаданные - журналом"""
+        with self._save_lock:
+            index_bytes = None
+            if self.vectors_dirty:
+                with self._lock.read():
+                    if self.index is not None:
+                        index_bytes = faiss.serialize_index(self.index)
+                    # Добавление векторов ждет читателей, поэтому флаг не сбросит чужие изменения
+                    self.vectors_dirty = False
+            with self._meta_lock:
+                changed, self._meta_changed = self._meta_changed, set()
+                entries = [(ticket_id, dict(self.meta[ticket_id])) for ticket_id in changed if ticket_id in self.meta]
+            if index_bytes is None and not entries:
+                return
+
+            try:
+                os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+                # Сначала индекс: вектор без метаданных безвреден, а метаданные
+                # без вектора скрыли бы заявку от повторной индексации
+                if index_bytes is not None:
+                    index_bytes.tofile(f'{self.index_path}.tmp')
+                    os.replace(f'{self.index_path}.tmp', self.index_path)
+                if entries:
+                    with open(self.meta_log_path, 'a', encoding='utf-8') as f:
+                        f.writelines(
+                            json.dumps([ticket_id, ticket_meta], ensure_ascii=False) + '\n'
+                            for ticket_id, ticket_meta in entries
+                        )
+                    self._meta_log_entries += len(entries)
+            except Exception:
+                # Повторим при следующем сохранении
+                if index_bytes is not None:
+                    self.vectors_dirty = True
+                with self._meta_lock:
+                    self._meta_changed |= changed
+                raise
+
+            if self._meta_log_entries > max(META_LOG_COMPACT_MIN, len(self.meta)):
+                self._compact_meta()
+
+    def _compact_meta(self):
+        """Сворачивает журнал метаданных в снимок"""
+        with self._meta_lock:
+            # Изменения, еще не попавшие в журнал, войдут в снимок
+            snapshot = {ticket_id: dict(ticket_meta) for ticket_id, ticket_meta in self.meta.items()}
+            self._meta_changed = set()
+        with open(f'{self.meta_path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(f'{self.meta_path}.tmp', self.meta_path)
+        open(self.meta_log_path, 'w').close()
+        self._meta_log_entries = 0
+
+    @property
+    def dirty(self) -> bool:
+        return self.vectors_dirty or bool(self._meta_changed)
+
+    def __contains__(self, ticket_id: int) -> bool:
+        return ticket_id in self.meta
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+    def add(self, ticket_ids: List[int], embeddings: np.ndarray, metas: List[dict]):
+        """Добавляет новые заявки; уже проиндексированные только обновляют метаданные"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        with self._lock.write():
+            new_rows = [i for i, ticket_id in enumerate(ticket_ids) if ticket_id not in self.meta]
+            if new_rows:
+                vectors = embeddings[new_rows]
+                faiss.normalize_L2(vectors)
+                if self.index is None:
+                    self.index = self._create_index(vectors.shape[1])
+                ids = np.array([ticket_ids[i] for i in new_rows], dtype=np.int64)
+                self.index.add_with_ids(vectors, ids)
+                self.vectors_dirty = True
+            with self._meta_lock:
+                for ticket_id, meta in zip(ticket_ids, metas):
+                    self.meta.setdefault(ticket_id, {}).update(meta)
+                    self._meta_changed.add(ticket_id)
+
+    def update_meta(self, ticket_id: int, **fields):
+        """Обновляет метаданные заявки, которая уже есть в индексе"""
+        meta = self.meta.get(ticket_id)
+        if meta is None:
+            return
+        changed = {key: value for key, value in fields.items() if meta.get(key) != value}
+        if changed:
+            with self._meta_lock:
+                meta.update(changed)
+                self._meta_changed.add(ticket_id)
+
+    def search(self, embedding: np.ndarray, k: int = 5, min_score: float = 0.0) -> List[Tuple[int, float, dict]]:
+        """Возвращает до k заявок (ID, сходство, метаданные) со сходством не ниже min_score"""
+        if self.index is None or self.index.ntotal == 0:
+            return []
+        query = np.ascontiguousarray(np.atleast_2d(embedding), dtype=np.float32).copy()
+        faiss.normalize_L2(query)
+        with self._lock.read():
+            scores, ids = self.index.search(query, k)
+
+        results = []
+        for score, ticket_id in zip(scores[0], ids[0]):
+            if ticket_id < 0 or score < min_score:
+                continue
+            results.append((int(ticket_id), float(score), self.meta.get(int(ticket_id), {})))
+        return results
@@ -0,0 +1,75 @@
+from typing import Dict, Iterator, Optional, Tuple
+
+from utils.rendering import find_telegram_id_in_content
+
+# Префикс значения поля externalid заявки, в которое бот записывает владельца
+EXTERNALID_PREFIX = 'telegram:'
+# Заявка проверена, владельца в Telegram у нее нет
+NO_OWNER = 0
+
+
+def owner_externalid(telegram_id: int) -> str:
+    return f"{EXTERNALID_PREFIX}{telegram_id}"
+
+
+def parse_owner_externalid(value) -> Optional[int]:
+    """Telegram ID из поля externalid заявки или None"""
+    if not isinstance(value, str) or not value.startswith(EXTERNALID_PREFIX):
+        return None
+    value = value[len(EXTERNALID_PREFIX):]
+    return int(value) if value.isdigit() else None
+
+
+class TicketOwners:
+    """Владельцы заявок: ID заявки -> Telegram ID пользователя, создавшего ее через бота.
+
+    Владелец записывается при создании заявки, поэтому отбор заявок и выбор
+    получателя уведомления - поиск в словаре. Для заявок, созданных до
+    появления карты, владелец один раз определяется по полю externalid или
+    по описанию заявки, и результат (в том числе "владельца нет")
+    запоминается. Если передан store (StateStore), карта переживает перезапуск.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.backfilled = 0
+        self._owners: Dict[int, int] = {}
+
+    def restore(self, owners: Dict[int, int]):
+        self._owners.update(owners)
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        return iter(self._owners.items())
+
+    def set(self, ticket_id: int, telegram_id: Optional[int]):
+        telegram_id = telegram_id or NO_OWNER
+        if self._owners.get(ticket_id) == telegram_id:
+            return
+        self._owners[ticket_id] = telegram_id
+        if self.store is not None:
+            self.store.save_owner(ticket_id, telegram_id)
+
+    def known(self, ticket_id: int) -> bool:
+        """Владелец заявки уже определен (в том числе как "владельца нет")"""
+        return ticket_id in self._owners
+
+    def get(self, ticket_id: int) -> Optional[int]:
+        """Telegram ID владельца из карты, без определения по заявке"""
+        return self._owners.get(ticket_id) or None
+
+    def resolve(self, ticket: dict) -> Optional[int]:
+        """Telegram ID владельца заявки или None, если заявка создана не через бота"""
+        ticket_id = ticket.get('id')
+        owner = self._owners.get(ticket_id)
+        if owner is not None:
+            return owner or None
+        owner = parse_owner_externalid(ticket.get('externalid'))
+        if owner is None:
+            owner = find_telegram_id_in_content(ticket.get('content'))
+        if ticket_id is not None:
+            self.backfilled += 1
+            self.set(ticket_id, owner)
+        return owner
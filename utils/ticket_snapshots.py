@@ -0,0 +1,124 @@
+import hashlib
+import sys
+import time
+from typing import Dict, List, Optional
+
+# Статусы GLPI "Решена" и "Закрыта"
+CLOSED_STATUSES = (5, 6)
+# Сколько символов описания хранится для текста уведомления
+CONTENT_PREVIEW_LENGTH = 100
+
+
+def content_fingerprint(content: str) -> str:
+    """Короткий хэш описания: для сравнения полный текст хранить не нужно"""
+    return hashlib.blake2b((content or '').encode(), digest_size=8).hexdigest()
+
+
+def content_preview(content: str) -> str:
+    content = content or ''
+    if len(content) > CONTENT_PREVIEW_LENGTH:
+        return content[:CONTENT_PREVIEW_LENGTH] + '...'
+    return content
+
+
+class TicketSnapshot:
+    """Последнее известное состояние заявки.
+
+    Хранятся только отслеживаемые поля, хэш и начало описания, ID последнего
+    комментария и момент, с которого заявка решена или закрыта.
+    """
+
+    __slots__ = (
+        'name', 'status', 'urgency', 'impact', 'type', 'time_to_resolve',
+        'content_hash', 'content_preview', 'last_followup_id', 'closed_since',
+    )
+
+    def __init__(
+        self,
+        name: Optional[str] = None,
+        status: Optional[int] = None,
+        urgency: Optional[int] = None,
+        impact: Optional[int] = None,
+        type: Optional[int] = None,
+        time_to_resolve: Optional[str] = None,
+        content_hash: str = '',
+        content_preview: str = '',
+        last_followup_id: int = 0,
+        closed_since: Optional[float] = None,
+    ):
+        self.name = name
+        self.status = status
+        self.urgency = urgency
+        self.impact = impact
+        self.type = type
+        self.time_to_resolve = time_to_resolve
+        self.content_hash = content_hash
+        self.content_preview = content_preview
+        self.last_followup_id = last_followup_id
+        self.closed_since = closed_since
+
+    @classmethod
+    def from_ticket(
+        cls, ticket: dict, content: str, last_followup_id: int, previous: Optional['TicketSnapshot'] = None
+    ) -> 'TicketSnapshot':
+        """Снимок заявки из GLPI; content - описание, уже очищенное от HTML"""
+        status = ticket.get('status')
+        closed_since = None
+        if status in CLOSED_STATUSES:
+            closed_since = previous.closed_since if previous is not None and previous.closed_since else time.time()
+        return cls(
+            name=ticket.get('name'),
+            status=status,
+            urgency=ticket.get('urgency'),
+            impact=ticket.get('impact'),
+            type=ticket.get('type'),
+            time_to_resolve=ticket.get('time_to_resolve'),
+            content_hash=content_fingerprint(content),
+            content_preview=content_preview(content),
+            last_followup_id=last_followup_id,
+            closed_since=closed_since,
+        )
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'TicketSnapshot':
+        data = dict(data)
+        # Состояния, сохраненные до появления снимков, содержат полное описание
+        if 'content' in data:
+            content = data.pop('content') or ''
+            data.setdefault('content_hash', content_fingerprint(content))
+            data.setdefault('content_preview', content_preview(content))
+        return cls(**{field: data[field] for field in cls.__slots__ if field in data})
+
+    def nbytes(self) -> int:
+        """Примерный объем памяти снимка вместе со строками"""
+        size = sys.getsizeof(self)
+        for field in self.__slots__:
+            value = getattr(self, field)
+            if isinstance(value, (str, float)) or (isinstance(value, int) and value > 256):
+                size += sys.getsizeof(value)
+        return size
+
+
+def evict_closed_snapshots(snapshots: Dict[int, TicketSnapshot], max_age: float) -> List[int]:
+    """Удаляет снимки заявок, которые решены или закрыты дольше max_age секунд"""
+    deadline = time.time() - max_age
+    evicted = [
+        ticket_id for ticket_id, snapshot in snapshots.items()
+        if snapshot.closed_since is not None and snapshot.closed_since < deadline
+    ]
+    for ticket_id in evicted:
+        del snapshots[ticket_id]
+    return evicted
+
+
+def snapshots_footprint(snapshots: Dict[int, TicketSnapshot]) -> dict:
+    """Число снимков и примерный объем памяти, который они занимают"""
+    size = sys.getsizeof(snapshots) + sum(snapshot.nbytes() for snapshot in snapshots.values())
+    return {
+        'count': len(snapshots),
+        'closed': sum(1 for snapshot in snapshots.values() if snapshot.closed_since is not None),
+        'bytes': size,
+    }
@@ -0,0 +1,155 @@
+import json
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Допустимые форматы хранения векторов
+DTYPES = ('float32', 'float16', 'int8')
+
+# Максимальное отклонение косинусного сходства от float32 для нормированных
+# векторов размерности 384 (модель paraphrase-multilingual-MiniLM-L12-v2):
+# float16 - округление компонент до 11 бит мантиссы, int8 - симметричная
+# построчная квантизация со шкалой max|x|/127
+SCORE_TOLERANCE = {
+    'float32': 1e-6,
+    'float16': 1e-3,
+    'int8': 1e-2,
+}
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Нормирует строки матрицы, чтобы скалярное произведение давало косинусное сходство"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Переводит нормированные float32-векторы в формат хранения; для int8 возвращает построчные шкалы"""
+    if dtype == 'float32':
+        return np.ascontiguousarray(vectors, dtype=np.float32), None
+    if dtype == 'float16':
+        return np.ascontiguousarray(vectors, dtype=np.float16), None
+    if dtype == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.rint(vectors / scales[:, None]).clip(-127, 127).astype(np.int8)
+        return np.ascontiguousarray(quantized), scales.astype(np.float32)
+    raise ValueError(f'Неизвестный формат векторов: {dtype}')
+
+
+class VectorStore:
+    """Компактное хранилище векторов.
+
+    Все векторы лежат одной непрерывной матрицей (нормированной, в float32,
+    float16 или int8 с построчными шкалами), ID - отдельным массивом. На диске
+    это набор .npy-файлов, которые открываются через memory map: несколько
+    процессов бота читают одну копию из страничного кэша ОС. Отклонение
+    сходства от float32 не превышает SCORE_TOLERANCE[dtype].
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+        scales: Optional[np.ndarray] = None,
+        dtype: str = 'float32',
+    ):
+        self.ids = ids
+        self.vectors = vectors
+        self.scales = scales
+        self.dtype = dtype
+
+    @classmethod
+    def from_embeddings(cls, ids: Sequence[int], embeddings: np.ndarray, dtype: str = 'float32') -> 'VectorStore':
+        vectors, scales = quantize(normalize_rows(np.atleast_2d(embeddings)), dtype)
+        return cls(np.asarray(ids, dtype=np.int64), vectors, scales, dtype)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def add(self, ids: Sequence[int], embeddings: np.ndarray):
+        """Добавляет векторы (хранилище, открытое с диска, при этом копируется в память)"""
+        vectors, scales = quantize(normalize_rows(np.atleast_2d(embeddings)), self.dtype)
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.vectors = np.concatenate([self.vectors, vectors])
+        if scales is not None:
+            self.scales = np.concatenate([self.scales, scales])
+
+    def remove(self, ids: Sequence[int]):
+        """Удаляет векторы с указанными ID"""
+        keep = ~np.isin(self.ids, np.asarray(list(ids), dtype=np.int64))
+        if keep.all():
+            return
+        self.ids = self.ids[keep]
+        self.vectors = self.vectors[keep]
+        if self.scales is not None:
+            self.scales = self.scales[keep]
+
+    def upsert(self, ids: Sequence[int], embeddings: np.ndarray):
+        """Заменяет векторы с существующими ID и добавляет новые"""
+        self.remove(ids)
+        self.add(ids, embeddings)
+
+    def similarities(self, queries: np.ndarray) -> np.ndarray:
+        """Косинусное сходство запросов со всеми векторами: матрица (запросы x векторы)"""
+        queries = normalize_rows(np.atleast_2d(queries))
+        if self.dtype == 'float32':
+            return queries @ self.vectors.T
+        scores = queries @ self.vectors.T.astype(np.float32)
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search(self, query: np.ndarray, k: int = 5) -> List[Tuple[int, float]]:
+        """k ближайших векторов к одному запросу: [(ID, сходство)] по убыванию"""
+        if len(self) == 0:
+            return []
+        scores = self.similarities(query)[0]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[i]), float(scores[i])) for i in top]
+
+    def save(self, path_prefix: str):
+        """Сохраняет хранилище в {path_prefix}.*.npy; файлы заменяются атомарно"""
+        os.makedirs(os.path.dirname(path_prefix) or '.', exist_ok=True)
+        arrays = {'ids': self.ids, 'vectors': self.vectors}
+        if self.scales is not None:
+            arrays['scales'] = self.scales
+        for name, array in arrays.items():
+            tmp_path = f'{path_prefix}.{name}.tmp.npy'
+            np.save(tmp_path, array)
+            os.replace(tmp_path, f'{path_prefix}.{name}.npy')
+        # Метаданные пишутся последними: по ним load понимает, что набор файлов полный
+        with open(f'{path_prefix}.tmp.json', 'w', encoding='utf-8') as f:
+            json.dump({'dtype': self.dtype, 'count': len(self.ids), 'dim': self.dim}, f)
+        os.replace(f'{path_prefix}.tmp.json', f'{path_prefix}.json')
+
+    @classmethod
+    def load(cls, path_prefix: str, mmap: bool = True) -> Optional['VectorStore']:
+        """Открывает хранилище с диска (по умолчанию только для чтения через memory map)"""
+        meta_path = f'{path_prefix}.json'
+        if not os.path.exists(meta_path):
+            return None
+        mmap_mode = 'r' if mmap else None
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        ids = np.load(f'{path_prefix}.ids.npy', mmap_mode=mmap_mode)
+        vectors = np.load(f'{path_prefix}.vectors.npy', mmap_mode=mmap_mode)
+        scales = None
+        if meta['dtype'] == 'int8':
+            scales = np.load(f'{path_prefix}.scales.npy', mmap_mode=mmap_mode)
+        if len(ids) != meta['count'] or vectors.shape != (meta['count'], meta['dim']):
+            raise ValueError(f'Файлы хранилища {path_prefix} не согласованы')
+        return cls(ids, vectors, scales, meta['dtype'])